@@ -1,32 +1,857 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_app_context
+from flask import get_template_attribute
+from flask import before_render_template, template_rendered
 import os
+import io
+import zlib
+import struct
+import random
+import cProfile
+import bisect
+import multiprocessing
+import math
+import hashlib
+import hmac
+import atexit
+import itertools
+import codecs
+import csv
+import json
+import time
+import queue
+import threading
+import base64
+import binascii
+import re
 import sqlite3
+import sys
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+from contextlib import contextmanager
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process init lock, single process assumed
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # optional: responses are gzip-compressed only
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = "change_this_to_random_secret"  # Change for production
 
 # Use an absolute path for DB to avoid CWD issues in different runners
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB = os.path.join(BASE_DIR, 'database.db')
-EXPORT_DIR = os.path.join(BASE_DIR, 'exports')
+# Overridable so benchmarks and extra workers can run against scratch data
+DB = os.environ.get('STUDENT_MARKS_DB') or os.path.join(BASE_DIR, 'database.db')
+EXPORT_DIR = os.environ.get('STUDENT_MARKS_EXPORT_DIR') or os.path.join(BASE_DIR, 'exports')
 os.makedirs(EXPORT_DIR, exist_ok=True)
 STUDENTS_EXPORT = os.path.join(EXPORT_DIR, 'students_data.txt')
 USERS_EXPORT = os.path.join(EXPORT_DIR, 'user_accounts.txt')
 LOGIN_EVENTS = os.path.join(EXPORT_DIR, 'login_events.txt')
+# flock()ed while one process initializes the DB so workers don't race each other
+INIT_LOCK_PATH = DB + '.init-lock'
+
+# ------------------------
+# Instrumentation
+# ------------------------
+# /metrics serves everything below in Prometheus text format
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+# /metrics is readable by logged-in admins, or by a scraper sending
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is configured
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Opt-in profiler: dump cProfile output for requests slower than this (0 = off)
+PROFILE_SLOW_REQUEST_MS = float(os.environ.get('PROFILE_SLOW_REQUEST_MS', '0'))
+# Fraction of requests to run under the profiler while it is enabled
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '1.0'))
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket latency histogram (seconds), Prometheus style."""
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._count = 0
+        self._sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_seconds = self._sum
+        cumulative = list(itertools.accumulate(counts))
+        return {
+            'count': total,
+            'sum_seconds': round(total_seconds, 6),
+            'buckets': [{'le': le, 'count': c} for le, c in zip(self.buckets + (float('inf'),), cumulative)],
+            'p50_seconds': self._quantile(cumulative, total, 0.50),
+            'p95_seconds': self._quantile(cumulative, total, 0.95),
+            'p99_seconds': self._quantile(cumulative, total, 0.99),
+        }
+
+    def _quantile(self, cumulative, total: int, q: float):
+        """Upper bound of the bucket holding the q-quantile (None if no samples)."""
+        if not total:
+            return None
+        rank = q * total
+        for le, c in zip(self.buckets + (float('inf'),), cumulative):
+            if c >= rank:
+                return le
+        return float('inf')
+
+
+class MetricsRegistry:
+    """Named, labelled latency histograms and counters shared by the whole app."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, LatencyHistogram())
+        return hist
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        self.histogram(name, **labels).observe(seconds)
+
+    def inc(self, name: str, value: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self, lines: list) -> None:
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_prom_labels(dict(labels))} {value}')
+        for (name, labels), hist in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            _prom_histogram(lines, name, dict(labels), hist.snapshot())
+
+
+def _prom_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    def esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in labels.items()) + '}'
+
+
+def _prom_histogram(lines: list, name: str, labels: dict, snapshot: dict) -> None:
+    for bucket in snapshot['buckets']:
+        le = '+Inf' if bucket['le'] == float('inf') else repr(bucket['le'])
+        lines.append(f"{name}_bucket{_prom_labels(dict(labels, le=le))} {bucket['count']}")
+    lines.append(f"{name}_sum{_prom_labels(labels)} {snapshot['sum_seconds']}")
+    lines.append(f"{name}_count{_prom_labels(labels)} {snapshot['count']}")
+
+
+metrics = MetricsRegistry()
+
+
+def timed(name: str):
+    """Decorator recording a function's wall time in app_function_duration_seconds."""
+    def decorator(fn):
+        hist = metrics.histogram('app_function_duration_seconds', function=name)
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+_fsync_latency = metrics.histogram('app_fsync_duration_seconds')
+
+
+def _fsync(fd) -> None:
+    started = time.perf_counter()
+    os.fsync(fd)
+    _fsync_latency.observe(time.perf_counter() - started)
+
+
+def _normalize_sql(sql: str) -> str:
+    return ' '.join(sql.split())[:200]
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times execute()/executemany() per statement.
+
+    The time covers running the statement up to its first row; rows fetched
+    later through the cursor are not included.
+    """
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            metrics.observe('sqlite_query_duration_seconds', time.perf_counter() - started, query=_normalize_sql(sql))
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            metrics.observe('sqlite_query_duration_seconds', time.perf_counter() - started, query=_normalize_sql(sql))
+
+
+# Connection pool sizing and per-connection tuning
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = 10.0  # seconds to wait for a free connection
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # readers don't block the writer
+    ('synchronous', 'NORMAL'),      # fsync at checkpoints, safe with WAL
+    ('busy_timeout', '5000'),       # wait for the write lock instead of failing
+    ('mmap_size', str(256 * 1024 * 1024)),
+    ('cache_size', str(-16000)),    # negative = KiB, so ~16 MB page cache
+    ('temp_store', 'MEMORY'),
+)
 
 # Database connection
 def get_db_connection():
-    conn = sqlite3.connect(DB)
+    """Open a new tuned connection. Prefer get_db() / db_pool, which reuse them."""
+    # Per-query timing only when metrics are on; otherwise a plain connection
+    factory = InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(DB, check_same_thread=False, factory=factory)
     conn.row_factory = sqlite3.Row
+    for name, value in SQLITE_PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
     return conn
 
-# Initialize database
-def init_db():
-    conn = get_db_connection()
 
-    # Students table
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections.
+
+    Connections are created lazily up to `max_size`; callers beyond that wait
+    (up to `timeout`) for one to be released. Counters are exposed through
+    stats() so the pool can be sized under load.
+    """
+
+    def __init__(self, factory, max_size: int, timeout: float):
+        self._factory = factory
+        self._max_size = max_size
+        self._timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._timeouts = 0
+
+    def acquire(self):
+        conn = None
+        create = False
+        with self._lock:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                if self._open < self._max_size:
+                    self._open += 1
+                    create = True
+        if create:
+            try:
+                conn = self._factory()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+        waited = 0.0
+        if conn is None:
+            start = time.perf_counter()
+            try:
+                conn = self._idle.get(timeout=self._timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise RuntimeError('Timed out waiting for a database connection')
+            waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_seconds += waited
+                self._max_wait_seconds = max(self._max_wait_seconds, waited)
+        return conn
+
+    def release(self, conn) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection: drop it instead of returning it to the pool
+            with self._lock:
+                self._open -= 1
+                self._in_use -= 1
+            conn.close()
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def close_idle(self) -> None:
+        """Close connections nobody has checked out (e.g. before a pre-fork server forks)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._open -= 1
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection outside of a request (startup, CLI, workers)."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max_size': self._max_size,
+                'open_connections': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_seconds_total': round(self._wait_seconds, 6),
+                'wait_seconds_max': round(self._max_wait_seconds, 6),
+                'timeouts': self._timeouts,
+            }
+
+
+db_pool = ConnectionPool(get_db_connection, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+
+def get_db():
+    """Connection bound to the current app context; returned to the pool on teardown."""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+
+@contextmanager
+def db_connection():
+    """The request's connection inside an app context, a pooled one elsewhere.
+
+    Helpers use this so a request never holds two pool slots at once.
+    """
+    if has_app_context():
+        yield get_db()
+    else:
+        with db_pool.connection() as conn:
+            yield conn
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+class VersionedCache:
+    """In-process cache whose entries are valid for one data version.
+
+    bump() is called after committed writes and drops every entry. A value
+    computed while a bump happens is not stored, so a reader can never cache
+    data from before a write under the version that follows it.
+
+    `source`, if given, returns a version shared by all processes (see
+    shared_version()); get() checks it first and bumps when it has moved, so
+    writes made by other workers invalidate this cache too.
+
+    A compute() result of None (a miss) is never stored. `max_entries` bounds
+    caches keyed by client input; the least recently used entry is evicted.
+    """
+
+    def __init__(self, source=None, max_entries=None):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._source = source
+        self._source_version = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def bump(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def get(self, key, compute):
+        if self._source is not None:
+            shared = self._source()
+            if shared != self._source_version:
+                with self._lock:
+                    if shared != self._source_version:
+                        self._source_version = shared
+                        self._version += 1
+                        self._entries.clear()
+        with self._lock:
+            version = self._version
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        value = compute()
+        if value is None:
+            return None
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (version, value)
+                self._entries.move_to_end(key)
+                if self._max_entries is not None and len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+
+# ------------------------
+# Multi-process coordination
+# ------------------------
+# Running several workers (e.g. `gunicorn -w 4 'app:create_app()'`) against
+# one database is supported. Every worker is a separate process; shared state
+# lives in SQLite or on disk and is coordinated as follows:
+#   - sessions are signed cookies, so any worker can serve any request
+#   - app_meta.students_version / users_version are bumped by triggers in the
+#     writing transaction; in-process caches compare against them on read
+#   - aggregate tables are only written inside BEGIN IMMEDIATE transactions,
+#     so deltas and full recomputes from different workers serialize
+#   - text exports are installed under the database write lock and only if
+#     newer than what another worker already installed
+#   - login events are appended and rotated under an flock()
+#   - startup work runs once, under INIT_LOCK_PATH (see initialize_app())
+# /metrics, /api/db/pool and the other status endpoints report per worker.
+# `python benchmark.py multiproc` exercises this with N local processes.
+@contextmanager
+def _process_lock(path: str):
+    """Exclusive advisory lock shared by every process using the same path."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def shared_version(key: str = 'students_version'):
+    """Current value of an app_meta change counter (one primary-key lookup)."""
+    with db_connection() as conn:
+        return _get_meta(conn, key)
+
+
+def aggregates_shared_version():
+    """Version of data derived from the aggregate tables.
+
+    Moves on student writes and also on full recomputes (repairs), which
+    rewrite the aggregates without touching students.
+    """
+    with db_connection() as conn:
+        return (_get_meta(conn, 'students_version'), _get_meta(conn, 'aggregates_version'))
+
+
+# Serialized /api/stats payloads, invalidated by student mutations in any worker
+stats_cache = VersionedCache(source=aggregates_shared_version)
+
+# ------------------------
+# Analytics snapshot
+# ------------------------
+# Opt-in: keep a compact column-oriented copy of students in each worker and
+# serve dashboard()/stats_api() aggregates from it instead of SQL
+ANALYTICS_SNAPSHOT = os.environ.get('ANALYTICS_SNAPSHOT', '0') == '1'
+SNAPSHOT_FETCH_SIZE = 5000
+# Typecode to switch to when a value doesn't fit the column's current one
+_WIDER_TYPECODE = {'h': 'i', 'i': 'q', 'H': 'I', 'I': 'Q'}
+
+
+def _array_store(arr, value, index=None, insert=False):
+    """arr.append / arr[index] = / arr.insert, widening the typecode on overflow. Returns the array."""
+    try:
+        if index is None:
+            arr.append(value)
+        elif insert:
+            arr.insert(index, value)
+        else:
+            arr[index] = value
+        return arr
+    except OverflowError:
+        if arr.typecode not in _WIDER_TYPECODE:
+            raise
+        return _array_store(array(_WIDER_TYPECODE[arr.typecode], arr), value, index, insert)
+
+
+class StudentSnapshot:
+    """Array-backed, dictionary-encoded copy of the columns the analytics read.
+
+    ids (sorted, int64), marks (int16, widened if needed) and subject/grade
+    codes (uint16 indexes into `subjects` / `grades`) take ~14 bytes a row.
+    Per-code and per-marks counters are maintained with the columns, so the
+    dashboard/stats aggregates cost O(distinct values) instead of a scan.
+
+    Committed writes are applied incrementally via apply() (fed by
+    _write_transaction()); the columns record the students_version they
+    reflect, and any gap (another worker's write, a bulk import) makes the
+    next read reload from SQL instead.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.RLock()
+        self._version = None
+        self._reloads = 0
+        self._applied = 0
+        self._invalidations = 0
+        self._last_reload_seconds = None
+        self._clear()
+
+    def _clear(self) -> None:
+        self.ids = array('q')
+        self.marks = array('h')
+        self.subject_codes = array('H')
+        self.grade_codes = array('H')
+        self.subjects, self._subject_index = [], {}
+        self.grades, self._grade_index = [], {}
+        self._subject_counts = Counter()
+        self._grade_counts = Counter()
+        self._marks_counts = Counter()
+        self._sum = 0
+
+    @staticmethod
+    def _encode(values: list, index: dict, value) -> int:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(values)
+            values.append(value)
+        return code
+
+    def _reload(self) -> None:
+        started = time.perf_counter()
+        self._clear()
+        with db_connection() as conn:
+            # Version and rows from one read snapshot
+            conn.execute('BEGIN')
+            try:
+                version = _get_meta(conn, 'students_version')
+                cur = conn.execute('SELECT id, subject, marks, grade FROM students ORDER BY id')
+                encode_subject = self._subject_index.get
+                encode_grade = self._grade_index.get
+                while True:
+                    rows = cur.fetchmany(SNAPSHOT_FETCH_SIZE)
+                    if not rows:
+                        break
+                    for row_id, subject, marks, grade in rows:
+                        self.ids.append(row_id)
+                        self.marks = _array_store(self.marks, marks)
+                        code = encode_subject(subject)
+                        self.subject_codes.append(code if code is not None else self._encode(self.subjects, self._subject_index, subject))
+                        grade = _grade_key(grade)
+                        code = encode_grade(grade)
+                        self.grade_codes.append(code if code is not None else self._encode(self.grades, self._grade_index, grade))
+            finally:
+                conn.rollback()
+        # Counters over whole columns run in C
+        self._subject_counts = Counter(self.subject_codes)
+        self._grade_counts = Counter(self.grade_codes)
+        self._marks_counts = Counter(self.marks)
+        self._sum = sum(self.marks)
+        self._version = version
+        self._reloads += 1
+        self._last_reload_seconds = time.perf_counter() - started
+
+    def _count(self, pos: int, sign: int) -> None:
+        for counter, key in ((self._subject_counts, self.subject_codes[pos]),
+                             (self._grade_counts, self.grade_codes[pos]),
+                             (self._marks_counts, self.marks[pos])):
+            counter[key] += sign
+            if not counter[key]:
+                del counter[key]
+        self._sum += sign * self.marks[pos]
+
+    def _put(self, student_id: int, student: dict) -> None:
+        pos = bisect.bisect_left(self.ids, student_id)
+        subject = self._encode(self.subjects, self._subject_index, student['subject'])
+        grade = self._encode(self.grades, self._grade_index, _grade_key(student['grade']))
+        if pos < len(self.ids) and self.ids[pos] == student_id:
+            self._count(pos, -1)
+            self.marks = _array_store(self.marks, int(student['marks']), pos)
+            self.subject_codes = _array_store(self.subject_codes, subject, pos)
+            self.grade_codes = _array_store(self.grade_codes, grade, pos)
+        else:
+            # New ids are the largest, so this is an append in practice
+            self.ids.insert(pos, student_id)
+            self.marks = _array_store(self.marks, int(student['marks']), pos, insert=True)
+            self.subject_codes = _array_store(self.subject_codes, subject, pos, insert=True)
+            self.grade_codes = _array_store(self.grade_codes, grade, pos, insert=True)
+        self._count(pos, 1)
+
+    def _delete(self, student_id: int) -> None:
+        pos = bisect.bisect_left(self.ids, student_id)
+        if pos < len(self.ids) and self.ids[pos] == student_id:
+            self._count(pos, -1)
+            for column in (self.ids, self.marks, self.subject_codes, self.grade_codes):
+                del column[pos]
+
+    def apply(self, version: int, changes: list) -> None:
+        """Fold a committed transaction's changes in; `version` is students_version after it.
+
+        changes: ('put', id, student) / ('delete', id) / ('reset',). Each put or
+        delete bumped the version once, so they apply only on top of exactly
+        version - len(changes); otherwise the snapshot is dropped and reloaded
+        on the next read.
+        """
+        with self._lock:
+            if self._version is None:
+                return
+            if self._version != version - len(changes) or any(c[0] == 'reset' for c in changes):
+                self._version = None
+                self._invalidations += 1
+                return
+            for change in changes:
+                if change[0] == 'put':
+                    self._put(change[1], change[2])
+                else:
+                    self._delete(change[1])
+            self._version = version
+            self._applied += len(changes)
+
+    def aggregates(self) -> dict:
+        """Same shape as _analytics_from_sql(); reloads first if the DB moved on."""
+        version = shared_version()
+        with self._lock:
+            if self._version != version:
+                self._reload()
+            total = len(self.ids)
+            return {
+                'total_students': total,
+                'avg_marks': self._sum / total if total else None,
+                'highest_marks': max(self._marks_counts) if total else None,
+                'lowest_marks': min(self._marks_counts) if total else None,
+                'grade_distribution': [{'grade': grade, 'count': count} for grade, count in
+                                       sorted((self.grades[code], count) for code, count in self._grade_counts.items())],
+                'subjects': sorted(self.subjects[code] for code in self._subject_counts if self.subjects[code].strip()),
+            }
+
+    def memory_footprint(self) -> dict:
+        with self._lock:
+            columns = {name: getattr(self, name).itemsize * len(getattr(self, name))
+                       for name in ('ids', 'marks', 'subject_codes', 'grade_codes')}
+            dictionaries = sum(sys.getsizeof(v) for v in self.subjects + self.grades)
+            total = sum(columns.values()) + dictionaries
+            return {
+                'rows': len(self.ids),
+                'column_bytes': columns,
+                'typecodes': {name: getattr(self, name).typecode for name in columns},
+                'dictionary_bytes': dictionaries,
+                'total_bytes': total,
+                'bytes_per_row': round(total / len(self.ids), 2) if self.ids else None,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'loaded': self._version is not None,
+                'version': self._version,
+                'reloads': self._reloads,
+                'last_reload_seconds': self._last_reload_seconds,
+                'applied_changes': self._applied,
+                'invalidations': self._invalidations,
+                'memory': self.memory_footprint(),
+            }
+
+
+student_snapshot = StudentSnapshot(ANALYTICS_SNAPSHOT)
+
+
+# ------------------------
+# Password hashing
+# ------------------------
+# Werkzeug method string, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'.
+# Stored hashes using a different method are upgraded on the next successful login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_HASH_SALT_LENGTH = int(os.environ.get('PASSWORD_HASH_SALT_LENGTH', '16'))
+# KDF work runs in this many worker processes (0 = inline in the request thread)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Hash jobs allowed in flight at once; further callers wait for a slot
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', str(max(1, PASSWORD_HASH_WORKERS) * 4)))
+# multiprocessing start method for the hash workers (None = platform default).
+# 'spawn'/'forkserver' re-import the main script, so only use them when it is guarded.
+PASSWORD_HASH_START_METHOD = os.environ.get('PASSWORD_HASH_START_METHOD') or None
+# After the pool breaks, hash inline for this long before starting new workers
+PASSWORD_HASH_RETRY_SECONDS = 30.0
+
+
+class PasswordHasher:
+    """Runs werkzeug's KDFs in a bounded process pool so they don't hold the GIL.
+
+    The pool is created on first use (never at import, so forked server
+    workers each get their own). Worker processes only ever run the werkzeug
+    KDF functions. If the pool breaks, hashing falls back to running inline
+    rather than failing logins.
+    """
+
+    def __init__(self, method: str, salt_length: int, workers: int, max_pending: int):
+        self.method = method
+        self.salt_length = salt_length
+        self._workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._retry_at = 0.0
+        self._prefix = None
+        self.latency = {'hash': LatencyHistogram(), 'verify': LatencyHistogram()}
+        self._fallbacks = 0
+        self._rehashes = 0
+
+    def hash(self, password: str) -> str:
+        return self._run('hash', generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pw_hash: str, password: str) -> bool:
+        return self._run('verify', check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        """True if `pw_hash` was produced with different parameters than `method`."""
+        if self._prefix is None:
+            # Werkzeug expands partial methods ('pbkdf2' -> 'pbkdf2:sha256:600000');
+            # hash a throwaway value once (off-thread) to learn the canonical prefix
+            self._prefix = self.hash('').split('$', 1)[0]
+        return pw_hash.split('$', 1)[0] != self._prefix
+
+    def record_rehash(self) -> None:
+        with self._lock:
+            self._rehashes += 1
+
+    def _run(self, op: str, fn, *args):
+        started = time.perf_counter()
+        with self._slots:
+            executor = self._get_executor()
+            result = None
+            if executor is not None:
+                try:
+                    result = executor.submit(fn, *args).result()
+                except BrokenProcessPool:
+                    with self._lock:
+                        if self._executor is executor:
+                            self._executor = None
+                            # Don't respawn workers on every call if they keep dying
+                            self._retry_at = time.monotonic() + PASSWORD_HASH_RETRY_SECONDS
+                        self._fallbacks += 1
+                    executor = None
+            if executor is None:
+                result = fn(*args)
+        self.latency[op].observe(time.perf_counter() - started)
+        return result
+
+    def _get_executor(self):
+        if self._workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                if time.monotonic() < self._retry_at:
+                    return None
+                self._executor = ProcessPoolExecutor(max_workers=self._workers,
+                                                     mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD))
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            'method': self.method,
+            'workers': self._workers,
+            'fallbacks': self._fallbacks,
+            'rehashes': self._rehashes,
+            'latency': {op: hist.snapshot() for op, hist in self.latency.items()},
+        }
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, PASSWORD_HASH_SALT_LENGTH,
+                                 PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+atexit.register(password_hasher.shutdown)
+
+
+def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+
+def _authenticate(conn, identifier: str, password: str):
+    """Return the user row if the password matches, upgrading outdated hashes in place."""
+    user = conn.execute('SELECT * FROM users WHERE username=? OR email=?', (identifier, identifier)).fetchone()
+    if not user or not password_hasher.verify(user['password_hash'], password):
+        return None
+    if password_hasher.needs_rehash(user['password_hash']):
+        try:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (hash_password(password), user['id']))
+            conn.commit()
+            password_hasher.record_rehash()
+        except sqlite3.Error:
+            # The old hash still works; try again on the next login
+            conn.rollback()
+    return user
+
+
+# Set by init_db(): whether SQLite has FTS5 and students_fts exists
+FTS_AVAILABLE = False
+
+
+# ------------------------
+# Schema migrations
+# ------------------------
+# Applied in order by init_db(); PRAGMA user_version records how many have run.
+# Databases created before versioning start at 0 and every step is idempotent,
+# so they are brought up to date without losing data.
+def _migrate_base_tables(conn):
     conn.execute('''
         CREATE TABLE IF NOT EXISTS students (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,8 +863,6 @@ def init_db():
             grade TEXT
         )
     ''')
-
-    # Admin users table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -48,25 +871,17 @@ def init_db():
             role TEXT NOT NULL DEFAULT 'user'
         )
     ''')
+    # Add email/role columns if they do not exist (pre-versioning DBs)
+    col_names = {c['name'] for c in conn.execute('PRAGMA table_info(users)').fetchall()}
+    if 'email' not in col_names:
+        conn.execute('ALTER TABLE users ADD COLUMN email TEXT')
+    if 'role' not in col_names:
+        conn.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
+    # Ensure existing 'admin' username keeps admin privileges
+    conn.execute("UPDATE users SET role='admin' WHERE username='admin'")
 
-    conn.commit()
-
-    # Add email/role columns if they do not exist (for existing DBs)
-    try:
-        cols = conn.execute('PRAGMA table_info(users)').fetchall()
-        col_names = {c['name'] for c in cols}
-        if 'email' not in col_names:
-            conn.execute('ALTER TABLE users ADD COLUMN email TEXT')
-            conn.commit()
-        if 'role' not in col_names:
-            conn.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
-            conn.commit()
-        # Ensure existing 'admin' username keeps admin privileges (idempotent)
-        conn.execute("UPDATE users SET role='admin' WHERE username='admin'")
-        conn.commit()
-    except Exception:
-        pass
 
+def _migrate_statistics_tables(conn):
     # Aggregate statistics table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS stats (
@@ -75,11 +890,47 @@ def init_db():
             avg_marks REAL,
             highest_marks INTEGER,
             lowest_marks INTEGER,
-            updated_at TEXT
+            updated_at TEXT,
+            sum_marks INTEGER NOT NULL DEFAULT 0
         )
     ''')
     # Ensure single row exists
     conn.execute('INSERT OR IGNORE INTO stats (id) VALUES (1)')
+    # Running sum used by the incremental statistics engine (pre-versioning DBs)
+    stats_cols = {c['name'] for c in conn.execute('PRAGMA table_info(stats)').fetchall()}
+    if 'sum_marks' not in stats_cols:
+        conn.execute('ALTER TABLE stats ADD COLUMN sum_marks INTEGER NOT NULL DEFAULT 0')
+
+    # Marks histogram (ordered by marks, gives MIN/MAX without scanning students)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS marks_histogram (
+            marks INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Per-subject and per-roll-number rollups, maintained with the global stats.
+    # `dimension` is a key of ROLLUP_DIMENSIONS, `key` the subject / roll_number.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollups (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            sum_marks INTEGER NOT NULL DEFAULT 0,
+            min_marks INTEGER,
+            max_marks INTEGER,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_histogram (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            marks INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, key, marks)
+        ) WITHOUT ROWID
+    ''')
 
     # Grade distribution table
     conn.execute('''
@@ -89,119 +940,1572 @@ def init_db():
         )
     ''')
 
-    conn.commit()
 
-    # admin user
-    cur = conn.execute("SELECT COUNT(*) as cnt FROM users").fetchone()
-    if cur['cnt'] == 0:
-        default_user = 'admin'
-        default_pass = 'admin123'
-        pw_hash = generate_password_hash(default_pass)
-        conn.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, 'admin')", (default_user, pw_hash))
-        conn.commit()
-        print("✅ Default admin created: username=admin password=admin123")
-    conn.close()
+def _migrate_student_indexes(conn):
+    # Indexes backing keyset pagination on /api/students (sort column, id)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_roll ON students (roll_number, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_subject_roll ON students (subject, roll_number, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_name ON students (name, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_marks ON students (marks, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_subject_marks ON students (subject, marks, id)')
+
+
+def _migrate_full_text_search(conn):
+    # Full-text index over students (external content, kept in sync by triggers)
+    conn.execute('SAVEPOINT fts')
+    try:
+        fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='students_fts'").fetchone()
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+                roll_number, name, email, subject,
+                content='students', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN
+                INSERT INTO students_fts (rowid, roll_number, name, email, subject)
+                VALUES (new.id, new.roll_number, new.name, new.email, new.subject);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN
+                INSERT INTO students_fts (students_fts, rowid, roll_number, name, email, subject)
+                VALUES ('delete', old.id, old.roll_number, old.name, old.email, old.subject);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF roll_number, name, email, subject ON students BEGIN
+                INSERT INTO students_fts (students_fts, rowid, roll_number, name, email, subject)
+                VALUES ('delete', old.id, old.roll_number, old.name, old.email, old.subject);
+                INSERT INTO students_fts (rowid, roll_number, name, email, subject)
+                VALUES (new.id, new.roll_number, new.name, new.email, new.subject);
+            END
+        ''')
+        if not fts_exists:
+            # Index rows that existed before the FTS table was created
+            conn.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+        conn.execute('RELEASE fts')
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5; /api/search falls back to LIKE prefix matching
+        conn.execute('ROLLBACK TO fts')
+        conn.execute('RELEASE fts')
+
+
+def _migrate_app_meta(conn):
+    # Change counters bumped by triggers in the same transaction as the write.
+    # Derived data (stats, text exports) records the counter it was built from,
+    # so startup can tell whether it is stale without scanning anything.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # stats/exports start out of date so they are rebuilt once after upgrading
+    conn.executemany('INSERT OR IGNORE INTO app_meta (key, value) VALUES (?, ?)', [
+        ('students_version', 0), ('users_version', 0), ('stats_version', -1),
+        ('students_export_version', -1), ('users_export_version', -1),
+    ])
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS app_meta_students_{event.lower()} AFTER {event} ON students BEGIN
+                UPDATE app_meta SET value = value + 1 WHERE key = 'students_version';
+            END
+        ''')
+    # Only the columns that appear in the users export; password rehashes don't count
+    for event in ('INSERT', 'DELETE', 'UPDATE OF username, email, role'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS app_meta_users_{event.split()[0].lower()} AFTER {event} ON users BEGIN
+                UPDATE app_meta SET value = value + 1 WHERE key = 'users_version';
+            END
+        ''')
+
+
+# Row snapshots written to change_log; password_hash is never copied out of users
+CHANGE_LOG_COLUMNS = {
+    'students': ('id', 'roll_number', 'name', 'email', 'subject', 'marks', 'grade'),
+    'users': ('id', 'username', 'email', 'role'),
+}
+
+
+def _migrate_change_log(conn):
+    # Change data capture: every committed insert/update/delete appends one row
+    # in the writer's transaction. AUTOINCREMENT keeps seq monotonic and never
+    # reuses a value after compaction, so it works as a resumable cursor.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            data TEXT,
+            changed_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    ''')
+    for table, columns in CHANGE_LOG_COLUMNS.items():
+        # Deletes carry the removed row so consumers can undo its effect
+        for event, op, row in (('INSERT', 'insert', 'NEW'), ('DELETE', 'delete', 'OLD'), ('UPDATE', 'update', 'NEW')):
+            if table == 'users' and event == 'UPDATE':
+                event = 'UPDATE OF ' + ', '.join(columns[1:])
+            data = ', '.join(f"'{column}', {row}.{column}" for column in columns)
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_{op} AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (table_name, op, row_id, data)
+                    VALUES ('{table}', '{op}', {row}.id, json_object({data}));
+                END
+            ''')
+
+
+def _migrate_subject_name_index(conn):
+    # ?subject=X&sort=name pages were sorting the whole subject in a temp B-tree
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_subject_name ON students (subject, name, id)')
+
+
+def _migrate_aggregates_version(conn):
+    # Bumped by recompute_statistics(), whose repairs leave students_version alone
+    conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('aggregates_version', 0)")
+
 
-init_db()
+MIGRATIONS = (
+    _migrate_base_tables,
+    _migrate_statistics_tables,
+    _migrate_student_indexes,
+    _migrate_full_text_search,
+    _migrate_app_meta,
+    _migrate_change_log,
+    _migrate_aggregates_version,
+    _migrate_subject_name_index,
+)
 
 
+def _get_meta(conn, key: str, default=None):
+    row = conn.execute('SELECT value FROM app_meta WHERE key=?', (key,)).fetchone()
+    return row['value'] if row else default
+
+
+def _set_meta(conn, key: str, value) -> None:
+    conn.execute('INSERT INTO app_meta (key, value) VALUES (?, ?) '
+                 'ON CONFLICT(key) DO UPDATE SET value = excluded.value', (key, value))
+
+
+# Initialize database
+def init_db() -> None:
+    """Apply pending migrations and create the default admin.
+
+    Cheap when the schema is current: one PRAGMA read and two lookups.
+    Callers serialize it across processes (see initialize_app()).
+    """
+    global FTS_AVAILABLE
+    conn = get_db_connection()
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with _write_transaction(conn):
+                migration(conn)
+                conn.execute(f'PRAGMA user_version={number}')
+
+        FTS_AVAILABLE = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='students_fts'").fetchone() is not None
+
+        # admin user
+        cur = conn.execute("SELECT COUNT(*) as cnt FROM users").fetchone()
+        if cur['cnt'] == 0:
+            default_user = 'admin'
+            default_pass = 'admin123'
+            pw_hash = generate_password_hash(default_pass, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_HASH_SALT_LENGTH)
+            conn.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, 'admin')", (default_user, pw_hash))
+            conn.commit()
+            print("✅ Default admin created: username=admin password=admin123")
+    finally:
+        conn.close()
+
+
+@timed('recompute_statistics')
 def recompute_statistics() -> None:
     """Recalculate aggregate student statistics and persist them.
 
+    Full rebuild from the `students` table; used at startup when the stored
+    aggregates are stale and to repair drift. Regular writes go through `apply_student_delta()` instead.
+
     - Updates single-row `stats`
-    - Rebuilds `grade_stats` from current `students` table
+    - Rebuilds `grade_stats`, `marks_histogram` and the per-subject/per-student
+      `rollups` / `rollup_histogram` from current `students` table
     """
-    conn = get_db_connection()
-    try:
+    # One BEGIN IMMEDIATE transaction: the reads below must not interleave with
+    # another worker's write, or the rebuilt aggregates would miss its delta
+    with db_connection() as conn, _write_transaction(conn):
         # Totals and aggregates
-        totals = conn.execute('SELECT COUNT(*) AS total, AVG(marks) AS avg_m, MAX(marks) AS max_m, MIN(marks) AS min_m FROM students').fetchone()
+        totals = conn.execute('SELECT COUNT(*) AS total, SUM(marks) AS sum_m, AVG(marks) AS avg_m, MAX(marks) AS max_m, MIN(marks) AS min_m FROM students').fetchone()
         total_students = int(totals['total'] or 0)
+        sum_marks = int(totals['sum_m'] or 0)
         avg_marks = float(totals['avg_m']) if totals['avg_m'] is not None else None
         highest_marks = int(totals['max_m']) if totals['max_m'] is not None else None
         lowest_marks = int(totals['min_m']) if totals['min_m'] is not None else None
 
-        conn.execute(
-            'UPDATE stats SET total_students=?, avg_marks=?, highest_marks=?, lowest_marks=?, updated_at=datetime("now") WHERE id=1',
-            (total_students, avg_marks, highest_marks, lowest_marks)
-        )
+        conn.execute(
+            'UPDATE stats SET total_students=?, sum_marks=?, avg_marks=?, highest_marks=?, lowest_marks=?, updated_at=datetime("now") WHERE id=1',
+            (total_students, sum_marks, avg_marks, highest_marks, lowest_marks)
+        )
+
+        conn.execute('DELETE FROM grade_stats')
+        for grade, count in _full_grade_distribution(conn).items():
+            conn.execute('INSERT INTO grade_stats (grade, count) VALUES (?, ?)', (grade, count))
+
+        conn.execute('DELETE FROM marks_histogram')
+        conn.execute('INSERT INTO marks_histogram (marks, count) SELECT marks, COUNT(*) FROM students GROUP BY marks')
+
+        conn.execute('DELETE FROM rollups')
+        conn.execute('DELETE FROM rollup_histogram')
+        for dimension, column in ROLLUP_DIMENSIONS.items():
+            conn.execute(
+                f'INSERT INTO rollups (dimension, key, count, sum_marks, min_marks, max_marks) '
+                f'SELECT ?, {column}, COUNT(*), SUM(marks), MIN(marks), MAX(marks) FROM students GROUP BY {column}',
+                (dimension,)
+            )
+            conn.execute(
+                f'INSERT INTO rollup_histogram (dimension, key, marks, count) '
+                f'SELECT ?, {column}, marks, COUNT(*) FROM students GROUP BY {column}, marks',
+                (dimension,)
+            )
+
+        _mark_stats_current(conn)
+        # A rebuild can change the aggregates without moving students_version;
+        # this tells caches in every worker (see aggregates_shared_version())
+        conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'aggregates_version'")
+    stats_cache.bump()
+    student_rollup_cache.bump()
+    dashboard_cache.bump()
+    ranking_cache.bump()
+
+
+def _full_grade_distribution(conn) -> dict:
+    # Grade distribution (normalize NULL/blank grades to 'Unassigned')
+    grade_rows = conn.execute(
+        """
+        SELECT COALESCE(NULLIF(TRIM(grade), ''), 'Unassigned') AS g, COUNT(*) AS count
+        FROM students
+        GROUP BY g
+        """
+    ).fetchall()
+    return {row['g']: row['count'] for row in grade_rows}
+
+
+# ------------------------
+# Incremental statistics
+# ------------------------
+# Rollup dimension -> students column it groups by
+ROLLUP_DIMENSIONS = {'subject': 'subject', 'student': 'roll_number'}
+
+def _grade_key(grade) -> str:
+    """Same normalization as the full recompute: blank/NULL -> 'Unassigned'."""
+    return (grade or '').strip() or 'Unassigned'
+
+
+def apply_student_delta(conn, old=None, new=None) -> None:
+    """Fold one student insert/update/delete into `stats`, `grade_stats` and `marks_histogram`.
+
+    `old` is the row before the write (None for inserts) and `new` the row
+    after it (None for deletes); both only need `marks` and `grade`. Runs on
+    the caller's connection so the aggregates commit together with the write.
+    Cost is a handful of primary-key lookups, independent of table size.
+    """
+    apply_student_deltas(conn, () if old is None else (old,), () if new is None else (new,))
+
+
+@timed('apply_student_deltas')
+def apply_student_deltas(conn, removed=(), added=()) -> None:
+    """Batch form of apply_student_delta(): one aggregate update for many rows.
+
+    Work is proportional to the number of distinct marks/grades touched, so a
+    bulk import of thousands of rows costs about as much as a single write.
+    """
+    d_count = 0
+    d_sum = 0
+    marks_delta = {}
+    grade_delta = {}
+    # (dimension, key) -> [count, sum]; (dimension, key, marks) -> count
+    rollup_delta = {}
+    rollup_hist_delta = {}
+    for sign, rows in ((-1, removed), (1, added)):
+        for row in rows:
+            marks = int(row['marks'])
+            grade = _grade_key(row['grade'])
+            d_count += sign
+            d_sum += sign * marks
+            marks_delta[marks] = marks_delta.get(marks, 0) + sign
+            grade_delta[grade] = grade_delta.get(grade, 0) + sign
+            for dimension, column in ROLLUP_DIMENSIONS.items():
+                totals = rollup_delta.setdefault((dimension, row[column]), [0, 0])
+                totals[0] += sign
+                totals[1] += sign * marks
+                hist_key = (dimension, row[column], marks)
+                rollup_hist_delta[hist_key] = rollup_hist_delta.get(hist_key, 0) + sign
+
+    _apply_rollup_deltas(conn, rollup_delta, rollup_hist_delta)
+
+    for marks, delta in marks_delta.items():
+        if delta:
+            _bump_counter(conn, 'marks_histogram', 'marks', marks, delta)
+    for grade, delta in grade_delta.items():
+        if delta:
+            _bump_counter(conn, 'grade_stats', 'grade', grade, delta)
+
+    # MIN/MAX come from the ordered histogram's primary key, not from students
+    conn.execute(
+        """
+        UPDATE stats SET
+            total_students = total_students + ?,
+            sum_marks = sum_marks + ?
+        WHERE id=1
+        """,
+        (d_count, d_sum)
+    )
+    conn.execute(
+        """
+        UPDATE stats SET
+            avg_marks = CASE WHEN total_students > 0 THEN CAST(sum_marks AS REAL) / total_students END,
+            highest_marks = (SELECT MAX(marks) FROM marks_histogram),
+            lowest_marks = (SELECT MIN(marks) FROM marks_histogram),
+            updated_at = datetime('now')
+        WHERE id=1
+        """
+    )
+    _mark_stats_current(conn)
+
+
+def _mark_stats_current(conn) -> None:
+    """Record that the aggregates reflect every students write so far (same transaction)."""
+    conn.execute("UPDATE app_meta SET value = (SELECT value FROM app_meta WHERE key='students_version') "
+                 "WHERE key='stats_version'")
+
+
+def _apply_rollup_deltas(conn, rollup_delta: dict, rollup_hist_delta: dict) -> None:
+    for (dimension, key, marks), delta in rollup_hist_delta.items():
+        if not delta:
+            continue
+        conn.execute(
+            'INSERT INTO rollup_histogram (dimension, key, marks, count) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(dimension, key, marks) DO UPDATE SET count = count + excluded.count',
+            (dimension, key, marks, delta)
+        )
+        conn.execute('DELETE FROM rollup_histogram WHERE dimension=? AND key=? AND marks=? AND count<=0',
+                     (dimension, key, marks))
+    for (dimension, key), (d_count, d_sum) in rollup_delta.items():
+        # An update that moves marks within the same key has d_count == 0 but may change MIN/MAX
+        conn.execute(
+            'INSERT INTO rollups (dimension, key, count, sum_marks) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(dimension, key) DO UPDATE SET count = count + excluded.count, sum_marks = sum_marks + excluded.sum_marks',
+            (dimension, key, d_count, d_sum)
+        )
+        conn.execute(
+            """
+            UPDATE rollups SET
+                min_marks = (SELECT MIN(marks) FROM rollup_histogram h WHERE h.dimension=rollups.dimension AND h.key=rollups.key),
+                max_marks = (SELECT MAX(marks) FROM rollup_histogram h WHERE h.dimension=rollups.dimension AND h.key=rollups.key)
+            WHERE dimension=? AND key=?
+            """,
+            (dimension, key)
+        )
+        conn.execute('DELETE FROM rollups WHERE dimension=? AND key=? AND count<=0', (dimension, key))
+
+
+def _bump_counter(conn, table: str, key_col: str, key, delta: int) -> None:
+    conn.execute(
+        f'INSERT INTO {table} ({key_col}, count) VALUES (?, ?) '
+        f'ON CONFLICT({key_col}) DO UPDATE SET count = count + excluded.count',
+        (key, delta)
+    )
+    # Drop empty buckets so MIN/MAX and the distribution match a full recompute
+    conn.execute(f'DELETE FROM {table} WHERE {key_col}=? AND count<=0', (key,))
+
+
+def check_statistics_consistency() -> list:
+    """Compare the incrementally maintained aggregates with a full recompute.
+
+    Read-only. Returns a list of human-readable mismatches (empty when consistent).
+    """
+    with db_connection() as conn:
+        stored = conn.execute('SELECT total_students, sum_marks, avg_marks, highest_marks, lowest_marks FROM stats WHERE id=1').fetchone()
+        full = conn.execute('SELECT COUNT(*) AS total, SUM(marks) AS sum_m, AVG(marks) AS avg_m, MAX(marks) AS max_m, MIN(marks) AS min_m FROM students').fetchone()
+        problems = []
+        expected = {
+            'total_students': int(full['total'] or 0),
+            'sum_marks': int(full['sum_m'] or 0),
+            'highest_marks': full['max_m'],
+            'lowest_marks': full['min_m'],
+        }
+        for key, value in expected.items():
+            if stored[key] != value:
+                problems.append(f"{key}: stored={stored[key]!r} expected={value!r}")
+        if (stored['avg_marks'] is None) != (full['avg_m'] is None) or (
+                full['avg_m'] is not None and abs(stored['avg_marks'] - full['avg_m']) > 1e-6):
+            problems.append(f"avg_marks: stored={stored['avg_marks']!r} expected={full['avg_m']!r}")
+
+        stored_grades = {row['grade']: row['count'] for row in conn.execute('SELECT grade, count FROM grade_stats').fetchall()}
+        expected_grades = _full_grade_distribution(conn)
+        if stored_grades != expected_grades:
+            problems.append(f"grade_stats: stored={stored_grades!r} expected={expected_grades!r}")
+
+        stored_hist = {row['marks']: row['count'] for row in conn.execute('SELECT marks, count FROM marks_histogram').fetchall()}
+        expected_hist = {row['marks']: row['count'] for row in conn.execute('SELECT marks, COUNT(*) AS count FROM students GROUP BY marks').fetchall()}
+        if stored_hist != expected_hist:
+            problems.append('marks_histogram differs from students')
+
+        for dimension, column in ROLLUP_DIMENSIONS.items():
+            stored_rollups = {
+                row['key']: tuple(row)[1:]
+                for row in conn.execute('SELECT key, count, sum_marks, min_marks, max_marks FROM rollups WHERE dimension=?', (dimension,)).fetchall()
+            }
+            expected_rollups = {
+                row['key']: tuple(row)[1:]
+                for row in conn.execute(f'SELECT {column} AS key, COUNT(*), SUM(marks), MIN(marks), MAX(marks) FROM students GROUP BY {column}').fetchall()
+            }
+            if stored_rollups != expected_rollups:
+                problems.append(f'rollups[{dimension}] differ from students')
+            stored_rhist = {
+                (row['key'], row['marks']): row['count']
+                for row in conn.execute('SELECT key, marks, count FROM rollup_histogram WHERE dimension=?', (dimension,)).fetchall()
+            }
+            expected_rhist = {
+                (row['key'], row['marks']): row['count']
+                for row in conn.execute(f'SELECT {column} AS key, marks, COUNT(*) AS count FROM students GROUP BY {column}, marks').fetchall()
+            }
+            if stored_rhist != expected_rhist:
+                problems.append(f'rollup_histogram[{dimension}] differs from students')
+        return problems
+
+
+# ------------------------
+# Student write helpers
+# ------------------------
+STUDENT_FIELDS = ('roll_number', 'name', 'email', 'subject', 'marks', 'grade')
+
+
+def _clean_student(raw):
+    """Validate submitted student fields (form, JSON or import row).
+
+    Returns (student, None) with normalized values, or (None, error message).
+    """
+    values = {f: str(raw.get(f) if raw.get(f) is not None else '').strip() for f in STUDENT_FIELDS}
+    if not (values['roll_number'] and values['name'] and values['subject'] and values['marks']):
+        return None, 'Please fill required fields'
+    try:
+        marks_int = int(values['marks'])
+    except ValueError:
+        return None, 'Marks must be an integer'
+    return {
+        'roll_number': values['roll_number'],
+        'name': values['name'],
+        'email': values['email'] or None,
+        'subject': values['subject'],
+        'marks': marks_int,
+        'grade': values['grade'] or None,
+    }, None
+
+
+def _insert_student_row(conn, student: dict) -> int:
+    cur = conn.execute('INSERT INTO students (roll_number, name, email, subject, marks, grade) VALUES (?, ?, ?, ?, ?, ?)',
+                       tuple(student[f] for f in STUDENT_FIELDS))
+    apply_student_delta(conn, None, student)
+    _record_student_change(conn, 'put', cur.lastrowid, student)
+    return cur.lastrowid
+
+
+def _update_student_row(conn, student_id: int, student: dict):
+    """Update a student and its aggregates. Returns the previous row, or None if missing."""
+    old = conn.execute('SELECT * FROM students WHERE id=?', (student_id,)).fetchone()
+    if old is None:
+        return None
+    conn.execute('UPDATE students SET roll_number=?, name=?, email=?, subject=?, marks=?, grade=? WHERE id=?',
+                 tuple(student[f] for f in STUDENT_FIELDS) + (student_id,))
+    apply_student_delta(conn, old, student)
+    _record_student_change(conn, 'put', student_id, student)
+    return old
+
+
+def _delete_student_row(conn, student_id: int):
+    """Delete a student and fold it out of the aggregates. Returns the deleted row, or None."""
+    old = conn.execute('SELECT * FROM students WHERE id=?', (student_id,)).fetchone()
+    if old is None:
+        return None
+    conn.execute('DELETE FROM students WHERE id=?', (student_id,))
+    apply_student_delta(conn, old, None)
+    _record_student_change(conn, 'delete', student_id)
+    return old
+
+
+@contextmanager
+def _write_transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT so a row and its aggregates are written atomically.
+
+    Taking the write lock up front also serializes concurrent writers, which the
+    read-modify-write of the aggregate tables relies on.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    conn.student_changes = []
+    try:
+        yield conn
+        changes = conn.student_changes
+        # students_version after this transaction, for the analytics snapshot
+        version = _get_meta(conn, 'students_version') if changes and student_snapshot.enabled else None
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.student_changes = None
+    conn.commit()
+    if version is not None:
+        student_snapshot.apply(version, changes)
+
+
+def _record_student_change(conn, *change) -> None:
+    """Note a students row change for student_snapshot (see StudentSnapshot.apply())."""
+    changes = getattr(conn, 'student_changes', None)
+    if changes is not None:
+        changes.append(change)
+
+# ------------------------
+# Text export helpers
+# ------------------------
+@timed('export_students_to_text')
+def export_students_to_text() -> None:
+    """Rewrite STUDENTS_EXPORT, streaming rows from the cursor to the temp file."""
+    def lines(conn):
+        rows = conn.execute('SELECT id, roll_number, name, email, subject, marks, grade FROM students ORDER BY roll_number')
+        yield "ID\tRoll\tName\tEmail\tSubject\tMarks\tGrade\n"
+        for r in rows:
+            yield f"{r['id']}\t{r['roll_number']}\t{r['name']}\t{r['email'] or ''}\t{r['subject']}\t{r['marks']}\t{r['grade'] or ''}\n"
+
+    with db_connection() as conn:
+        _install_export(conn, STUDENTS_EXPORT, 'students', lines)
+
+@timed('export_users_to_text')
+def export_users_to_text() -> None:
+    def lines(conn):
+        rows = conn.execute('SELECT id, username, email, role FROM users ORDER BY id')
+        yield "ID\tUsername\tEmail\tRole\n"
+        for r in rows:
+            yield f"{r['id']}\t{r['username']}\t{r['email'] or ''}\t{r['role']}\n"
+
+    with db_connection() as conn:
+        _install_export(conn, USERS_EXPORT, 'users', lines)
+
+
+def _install_export(conn, path: str, source: str, lines) -> bool:
+    """Write `lines(conn)` to `path` unless another worker already installed a newer export.
+
+    The rows and the `<source>_version` counter are read in one snapshot. The
+    rename and the `<source>_export_version` marker are then updated together
+    under the database write lock, so concurrent exporters can't replace a
+    newer file with an older one. Returns False if the export was discarded.
+    """
+    conn.execute('BEGIN')
+    try:
+        version = _get_meta(conn, f'{source}_version')
+        tmp_path = _write_lines_to_temp(path, lines(conn))
+    finally:
+        conn.rollback()
+    try:
+        with _write_transaction(conn):
+            if _get_meta(conn, f'{source}_export_version', -1) >= version and os.path.exists(path):
+                return False
+            os.replace(tmp_path, path)
+            _set_meta(conn, f'{source}_export_version', version)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def append_login_event(user_id: int, username: str, role: str) -> None:
+    line = f"{datetime.now().isoformat(timespec='seconds')}\tuser_id={user_id}\tusername={username}\trole={role}\n"
+    # Queued for the background writer, which appends and fsyncs in batches
+    login_event_writer.append(line)
+
+def _write_lines_to_temp(path: str, lines) -> str:
+    """Stream lines to an fsynced temp file next to `path`; returns the temp path."""
+    import tempfile
+    dir_name = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile('w', delete=False, dir=dir_name, encoding='utf-8') as tmp:
+        try:
+            tmp.writelines(lines)
+            tmp.flush()
+            _fsync(tmp.fileno())
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        return tmp.name
+
+
+# ------------------------
+# Background export writer
+# ------------------------
+# Mutations within this window are coalesced into a single rewrite
+EXPORT_DEBOUNCE_SECONDS = float(os.environ.get('EXPORT_DEBOUNCE_SECONDS', '1.0'))
+
+
+class ExportWorker:
+    """Runs an export function on a background thread whenever it is marked dirty.
+
+    The request path only calls mark_dirty(); the thread waits for the
+    debounce window so a burst of mutations becomes one rewrite. flush() runs
+    a pending export synchronously (used at exit and by CLI commands).
+    """
+
+    def __init__(self, name: str, export_fn, debounce: float):
+        self.name = name
+        self._export_fn = export_fn
+        self._debounce = debounce
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._dirty_since = None
+        self._requests = 0
+        self._runs = 0
+        self._failures = 0
+        self._last_duration = None
+        self._last_lag = None
+        self._max_lag = 0.0
+        self._last_completed_at = None
+
+    def mark_dirty(self) -> None:
+        with self._lock:
+            self._requests += 1
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'export-{self.name}', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def flush(self) -> None:
+        self._export_if_dirty()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(self._debounce)
+            self._wakeup.clear()
+            self._export_if_dirty()
+
+    def _export_if_dirty(self) -> None:
+        # Claim the dirty flag under the write lock so flush() can't return
+        # while the thread is still writing an export it already claimed
+        with self._write_lock:
+            with self._lock:
+                dirty_since = self._dirty_since
+                self._dirty_since = None
+            if dirty_since is None:
+                return
+            started = time.monotonic()
+            try:
+                self._export_fn()
+            except Exception:
+                with self._lock:
+                    self._failures += 1
+                    # Retry on the next mutation or flush
+                    if self._dirty_since is None:
+                        self._dirty_since = dirty_since
+                return
+            finished = time.monotonic()
+            with self._lock:
+                self._runs += 1
+                self._last_duration = finished - started
+                self._last_lag = finished - dirty_since
+                self._max_lag = max(self._max_lag, self._last_lag)
+                self._last_completed_at = time.time()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            pending = self._dirty_since is not None
+            return {
+                'pending': pending,
+                'pending_lag_seconds': round(time.monotonic() - self._dirty_since, 6) if pending else 0.0,
+                'requests': self._requests,
+                'runs': self._runs,
+                'coalesced': max(0, self._requests - self._runs - (1 if pending else 0)),
+                'failures': self._failures,
+                'last_duration_seconds': self._last_duration,
+                'last_lag_seconds': self._last_lag,
+                'max_lag_seconds': round(self._max_lag, 6),
+                'last_completed_at': self._last_completed_at,
+                'debounce_seconds': self._debounce,
+            }
+
+
+students_exporter = ExportWorker('students', export_students_to_text, EXPORT_DEBOUNCE_SECONDS)
+users_exporter = ExportWorker('users', export_users_to_text, EXPORT_DEBOUNCE_SECONDS)
+# Write out anything still pending when the process exits
+atexit.register(students_exporter.flush)
+atexit.register(users_exporter.flush)
+
+
+# ------------------------
+# Login event log writer
+# ------------------------
+LOGIN_EVENTS_BATCH_SIZE = int(os.environ.get('LOGIN_EVENTS_BATCH_SIZE', '100'))
+LOGIN_EVENTS_FLUSH_MS = int(os.environ.get('LOGIN_EVENTS_FLUSH_MS', '200'))
+LOGIN_EVENTS_QUEUE_SIZE = 10000
+LOGIN_EVENTS_ENQUEUE_TIMEOUT = 0.05  # how long a request may block on a full queue before dropping
+LOGIN_EVENTS_MAX_BYTES = int(os.environ.get('LOGIN_EVENTS_MAX_BYTES', str(10 * 1024 * 1024)))
+LOGIN_EVENTS_BACKUPS = int(os.environ.get('LOGIN_EVENTS_BACKUPS', '5'))
+
+
+class LoginEventWriter:
+    """Appends log lines from a background thread with group commit.
+
+    Lines are queued by the request and written in batches: a batch is
+    flushed and fsynced once it holds `batch_size` lines or `flush_ms` after
+    its first line arrived. The queue is bounded; when it is full, append()
+    blocks for at most `enqueue_timeout` and then drops the line, counting
+    it. The file is rotated (path.1 .. path.N) once it would exceed `max_bytes`.
+    close() drains the queue and is registered to run at exit.
+
+    Several processes may share the file: each batch is written under an
+    flock() on `path.lock`, and a writer whose file was rotated by another
+    process reopens the current one first.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, batch_size: int, flush_ms: int, queue_size: int,
+                 enqueue_timeout: float, max_bytes: int, backups: int):
+        self.path = path
+        self._batch_size = max(1, batch_size)
+        self._flush_seconds = flush_ms / 1000.0
+        self._enqueue_timeout = enqueue_timeout
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._rotations = 0
+        self._failures = 0
+        self._flush_seconds_total = 0.0
+
+    def append(self, line: str) -> None:
+        with self._lock:
+            if self._closed:
+                self._dropped += 1
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='login-events', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put(line, timeout=self._enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return
+        with self._lock:
+            self._enqueued += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(self._STOP)
+            thread.join()
+
+    def _run(self) -> None:
+        f = open(self.path, 'a', encoding='utf-8')
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is self._STOP:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self._flush_seconds
+                while len(batch) < self._batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                f = self._write_batch(f, batch)
+        finally:
+            f.close()
+
+    def _write_batch(self, f, batch):
+        data = ''.join(batch)
+        started = time.perf_counter()
+        try:
+            with _process_lock(self.path + '.lock'):
+                if f.closed or not os.path.exists(self.path) or not os.path.samestat(os.fstat(f.fileno()), os.stat(self.path)):
+                    # Rotated by another process (or closed by a failed reopen)
+                    f.close()
+                    f = open(self.path, 'a', encoding='utf-8')
+                size = os.fstat(f.fileno()).st_size
+                if size and size + len(data.encode('utf-8')) > self._max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.path, 'a', encoding='utf-8')
+                f.write(data)
+                f.flush()
+                _fsync(f.fileno())
+        except (OSError, ValueError):
+            # ValueError: f was left closed by a failed reopen; retried next batch
+            with self._lock:
+                self._failures += 1
+                self._dropped += len(batch)
+            return f
+        with self._lock:
+            self._written += len(batch)
+            self._flushes += 1
+            self._flush_seconds_total += time.perf_counter() - started
+        return f
+
+    def _rotate(self) -> None:
+        for i in range(self._backups - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self._backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        with self._lock:
+            self._rotations += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'dropped': self._dropped,
+                'flushes': self._flushes,
+                'avg_batch_size': round(self._written / self._flushes, 2) if self._flushes else 0.0,
+                'flush_seconds_total': round(self._flush_seconds_total, 6),
+                'rotations': self._rotations,
+                'failures': self._failures,
+            }
+
+
+login_event_writer = LoginEventWriter(
+    LOGIN_EVENTS, LOGIN_EVENTS_BATCH_SIZE, LOGIN_EVENTS_FLUSH_MS, LOGIN_EVENTS_QUEUE_SIZE,
+    LOGIN_EVENTS_ENQUEUE_TIMEOUT, LOGIN_EVENTS_MAX_BYTES, LOGIN_EVENTS_BACKUPS
+)
+atexit.register(login_event_writer.close)
+
+
+def _students_changed() -> None:
+    """Called after a committed student mutation; must stay cheap (request path)."""
+    stats_cache.bump()
+    student_rollup_cache.bump()
+    students_exporter.mark_dirty()
+    change_feed.notify()
+
+
+def _users_changed(user_id=None) -> None:
+    """Called after a committed users mutation; pass user_id when an existing account changed."""
+    if user_id is not None:
+        principal_cache.invalidate(user_id)
+        principal_cache.notify()
+    users_exporter.mark_dirty()
+    change_feed.notify()
+
+
+# ------------------------
+# App factory / startup
+# ------------------------
+_init_lock = threading.Lock()
+_initialized = False
+
+
+@timed('initialize_app')
+def _initialize() -> dict:
+    """Migrate the schema and rebuild whatever derived data is stale. Returns what was rebuilt."""
+    rebuilt = {'stats': False, 'students_export': False, 'users_export': False}
+    with _process_lock(INIT_LOCK_PATH):
+        init_db()
+        with db_connection() as conn:
+            meta = {row['key']: row['value'] for row in conn.execute('SELECT key, value FROM app_meta')}
+        if meta['stats_version'] != meta['students_version']:
+            recompute_statistics()
+            rebuilt['stats'] = True
+        if meta['students_export_version'] != meta['students_version'] or not os.path.exists(STUDENTS_EXPORT):
+            export_students_to_text()
+            rebuilt['students_export'] = True
+        if meta['users_export_version'] != meta['users_version'] or not os.path.exists(USERS_EXPORT):
+            export_users_to_text()
+            rebuilt['users_export'] = True
+    # Don't hand open SQLite handles to processes forked after startup
+    db_pool.close_idle()
+    return rebuilt
+
+
+def initialize_app() -> None:
+    """One-time startup work: migrations, default admin, stale stats/exports.
+
+    Idempotent and thread-safe; the DB work runs under a file lock so several
+    workers starting together do it once and the rest find everything current.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            _initialize()
+            _initialized = True
+
+
+def create_app():
+    """Initialize and return the Flask app (`gunicorn 'app:create_app()'`).
+
+    Importing this module does no database work; servers that import `app:app`
+    directly get the same initialization lazily on the first request.
+    """
+    initialize_app()
+    return app
+
+
+@app.before_request
+def _ensure_initialized():
+    initialize_app()
+
+# ------------------------
+# Bulk import
+# ------------------------
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_MAX_REPORTED_ERRORS = 1000
+# Header aliases, including the exports/students_data.txt header (ID column is ignored)
+IMPORT_HEADER_ALIASES = {
+    'roll': 'roll_number', 'roll_number': 'roll_number', 'roll no': 'roll_number', 'roll_no': 'roll_number',
+    'name': 'name', 'email': 'email', 'subject': 'subject', 'marks': 'marks', 'grade': 'grade',
+}
+
+
+@timed('import_students')
+def utf8_lines(binary):
+    """Decode a binary stream one line at a time (dropping a BOM).
+
+    Unlike a TextIOWrapper, which decodes ahead in blocks, a bad byte raises
+    only when its own line is reached, so everything before it can be used.
+    """
+    for index, line in enumerate(binary):
+        if index == 0 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8):]
+        yield line.decode('utf-8')
+
+
+def import_students(lines, delimiter=None, chunk_size=IMPORT_CHUNK_SIZE) -> dict:
+    """Stream CSV/TSV student rows into the database.
+
+    `lines` is any iterable of text lines whose first line is a header. The
+    delimiter is sniffed from the header (tab or comma) unless given. Rows are
+    validated with _clean_student() and inserted chunk by chunk with
+    executemany(), one transaction per chunk; each chunk folds its aggregate
+    delta in the same transaction. The text export is scheduled once at the end.
+    Returns a report with counts, throughput and per-row errors.
+
+    Input that isn't valid UTF-8 stops the import: rows before the bad line
+    are committed, `aborted` is set and the error names the line to resume from.
+    """
+    started = time.perf_counter()
+    report = {'rows_read': 0, 'inserted': 0, 'rejected': 0, 'errors': [], 'errors_truncated': False, 'aborted': False}
+    lines = iter(lines)
+    try:
+        header_line = next(lines, '')
+    except UnicodeDecodeError:
+        report['errors'].append({'line': 1, 'error': 'Not valid UTF-8 text'})
+        report.update(aborted=True, seconds=0.0, rows_per_second=0.0)
+        return report
+    if delimiter is None:
+        delimiter = '\t' if '\t' in header_line else ','
+    header = next(csv.reader([header_line], delimiter=delimiter), [])
+    columns = [IMPORT_HEADER_ALIASES.get(h.strip().lower()) for h in header]
+
+    missing = {'roll_number', 'name', 'subject', 'marks'} - set(columns)
+    if missing:
+        report['errors'].append({'line': 1, 'error': f"Missing columns: {', '.join(sorted(missing))}"})
+        report.update(seconds=0.0, rows_per_second=0.0)
+        return report
+
+    def add_error(line_no, message):
+        report['rejected'] += 1
+        if len(report['errors']) < IMPORT_MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line_no, 'error': message})
+        else:
+            report['errors_truncated'] = True
+
+    try:
+        with db_connection() as conn:
+            chunk = []
+            # Header is line 1; csv.reader keeps its own count for quoted newlines
+            reader = csv.reader(lines, delimiter=delimiter)
+            try:
+                for fields in reader:
+                    line_no = reader.line_num + 1
+                    if not any(f.strip() for f in fields):
+                        continue
+                    report['rows_read'] += 1
+                    if len(fields) > len(columns):
+                        add_error(line_no, 'Too many fields')
+                        continue
+                    student, error = _clean_student({col: val for col, val in zip(columns, fields) if col})
+                    if error:
+                        add_error(line_no, error)
+                        continue
+                    chunk.append(student)
+                    if len(chunk) >= chunk_size:
+                        report['inserted'] += _insert_student_chunk(conn, chunk)
+                        chunk = []
+            except UnicodeDecodeError:
+                # Reported even past IMPORT_MAX_REPORTED_ERRORS: it says where to resume
+                report['aborted'] = True
+                report['errors'].append({'line': reader.line_num + 2,
+                                         'error': f"Not valid UTF-8 text; rows before this line were imported "
+                                                  f"({report['inserted'] + len(chunk)} inserted)"})
+            if chunk:
+                report['inserted'] += _insert_student_chunk(conn, chunk)
+    finally:
+        # Also after a failure part-way: earlier chunks are already committed
+        if report['inserted']:
+            _students_changed()
+
+    seconds = time.perf_counter() - started
+    report['seconds'] = round(seconds, 3)
+    report['rows_per_second'] = round(report['rows_read'] / seconds, 1) if seconds > 0 else 0.0
+    return report
+
+
+def _insert_student_chunk(conn, students: list) -> int:
+    with _write_transaction(conn):
+        conn.executemany('INSERT INTO students (roll_number, name, email, subject, marks, grade) VALUES (?, ?, ?, ?, ?, ?)',
+                         [tuple(s[f] for f in STUDENT_FIELDS) for s in students])
+        apply_student_deltas(conn, (), students)
+        # executemany() doesn't report the new ids; the snapshot reloads instead
+        _record_student_change(conn, 'reset')
+    return len(students)
+
+
+# ------------------------
+# Batch mutations
+# ------------------------
+BATCH_MAX_OPS = int(os.environ.get('BATCH_MAX_OPS', '10000'))
+BATCH_OPS = ('insert', 'update', 'upsert', 'delete')
+
+
+class _BatchAborted(Exception):
+    """Raised inside the batch transaction to roll it back."""
+
+
+def _merge_student(existing, fields):
+    """Overlay the supplied fields on an existing row so updates may be partial."""
+    merged = {f: existing[f] for f in STUDENT_FIELDS}
+    merged.update({f: fields[f] for f in STUDENT_FIELDS if f in fields})
+    return merged
+
+
+@timed('student_batch')
+def apply_student_batch(ops: list, atomic: bool = True) -> dict:
+    """Apply insert/update/upsert/delete operations in a single write transaction.
+
+    Each op is a dict with an `op` key:
+      {"op": "insert", "student": {...}}
+      {"op": "update", "id": 5, "student": {...}}   fields not given are kept
+      {"op": "upsert", "student": {...}}            keyed by (roll_number, subject)
+      {"op": "delete", "id": 5}
+    An upsert updates the lowest-id row with that roll_number and subject, or
+    inserts one. With atomic=True any failed op rolls the whole batch back;
+    otherwise failed ops are skipped and the rest are committed. Aggregates are
+    folded once for the whole batch and exports are scheduled once.
+    """
+    results = []
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+    removed = []
+    added = []
+
+    def fail(index, op_name, message):
+        counts['failed'] += 1
+        results.append({'index': index, 'op': op_name, 'success': False, 'error': message})
+
+    def apply_op(conn, index, op):
+        op_name = op.get('op') if isinstance(op, dict) else None
+        if op_name not in BATCH_OPS:
+            return fail(index, op_name, f"op must be one of: {', '.join(BATCH_OPS)}")
+        fields = op.get('student') or {}
+        if not isinstance(fields, dict):
+            return fail(index, op_name, 'student must be an object')
+
+        existing = None
+        if op_name in ('update', 'delete'):
+            try:
+                student_id = int(op.get('id'))
+            except (TypeError, ValueError):
+                return fail(index, op_name, 'id must be an integer')
+            existing = conn.execute('SELECT * FROM students WHERE id=?', (student_id,)).fetchone()
+            if existing is None:
+                return fail(index, op_name, 'Record not found')
+        elif op_name == 'upsert':
+            key = {f: str(fields.get(f) or '').strip() for f in ('roll_number', 'subject')}
+            if not (key['roll_number'] and key['subject']):
+                return fail(index, op_name, 'Please fill required fields')
+            # Served by idx_students_subject_roll (subject, roll_number, id)
+            existing = conn.execute('SELECT * FROM students WHERE subject=? AND roll_number=? ORDER BY id LIMIT 1',
+                                    (key['subject'], key['roll_number'])).fetchone()
+
+        if op_name == 'delete':
+            conn.execute('DELETE FROM students WHERE id=?', (existing['id'],))
+            _record_student_change(conn, 'delete', existing['id'])
+            removed.append(existing)
+            counts['deleted'] += 1
+            results.append({'index': index, 'op': op_name, 'success': True, 'id': existing['id']})
+            return
+
+        student, error = _clean_student(_merge_student(existing, fields) if existing is not None else fields)
+        if error:
+            return fail(index, op_name, error)
+        if existing is None:
+            cur = conn.execute('INSERT INTO students (roll_number, name, email, subject, marks, grade) VALUES (?, ?, ?, ?, ?, ?)',
+                               tuple(student[f] for f in STUDENT_FIELDS))
+            _record_student_change(conn, 'put', cur.lastrowid, student)
+            added.append(student)
+            counts['inserted'] += 1
+            results.append({'index': index, 'op': op_name, 'success': True, 'id': cur.lastrowid, 'action': 'inserted'})
+        else:
+            conn.execute('UPDATE students SET roll_number=?, name=?, email=?, subject=?, marks=?, grade=? WHERE id=?',
+                         tuple(student[f] for f in STUDENT_FIELDS) + (existing['id'],))
+            _record_student_change(conn, 'put', existing['id'], student)
+            removed.append(existing)
+            added.append(student)
+            counts['updated'] += 1
+            results.append({'index': index, 'op': op_name, 'success': True, 'id': existing['id'], 'action': 'updated'})
+
+    committed = False
+    with db_connection() as conn:
+        try:
+            with _write_transaction(conn):
+                for index, op in enumerate(ops):
+                    apply_op(conn, index, op)
+                if atomic and counts['failed']:
+                    raise _BatchAborted()
+                apply_student_deltas(conn, removed, added)
+            committed = True
+        except _BatchAborted:
+            pass
+
+    if committed and (removed or added):
+        _students_changed()
+    if not committed:
+        counts.update(inserted=0, updated=0, deleted=0)
+    return {'committed': committed, 'counts': counts, 'results': results}
+
+
+# ------------------------
+# Request instrumentation
+# ------------------------
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILE_SLOW_REQUEST_MS > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            return
+        g.profiler = profiler
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('http_request_duration_seconds', elapsed, endpoint=endpoint, method=request.method)
+    metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if elapsed * 1000 >= PROFILE_SLOW_REQUEST_MS:
+            _dump_profile(profiler, endpoint, elapsed)
+    return response
+
+
+def _dump_profile(profiler, endpoint: str, elapsed: float) -> None:
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        path = os.path.join(PROFILE_DIR, f'{stamp}_{endpoint}_{int(elapsed * 1000)}ms.prof')
+        profiler.dump_stats(path)
+        metrics.inc('app_profiles_dumped_total', endpoint=endpoint)
+    except OSError:
+        pass
+
+
+_render_started = threading.local()
+
+
+@before_render_template.connect_via(app)
+def _template_render_started(sender, template, context, **extra):
+    _render_started.__dict__.setdefault('stack', []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def _template_render_finished(sender, template, context, **extra):
+    stack = _render_started.__dict__.get('stack')
+    if stack:
+        metrics.observe('template_render_duration_seconds', time.perf_counter() - stack.pop(), template=template.name)
+
+
+# ------------------------
+# Response compression
+# ------------------------
+COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', '1') != '0'
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '500'))
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+))
+# Preferred first; brotli only when the module is installed
+COMPRESS_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# A compressed body is a different representation, so its strong ETag gets a
+# suffix ("abc" -> "abc-gzip"). Incoming If-None-Match values have it stripped
+# again, so make_conditional() in the views matches either form.
+_ENCODED_ETAG_SUFFIX = re.compile(r'-(%s)"' % '|'.join(COMPRESS_ENCODINGS))
+
+
+def _compress_body(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    return compressor.compress(data) + compressor.flush()
+
+
+@app.before_request
+def _strip_encoded_etags():
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if COMPRESS_RESPONSES and if_none_match:
+        match = _ENCODED_ETAG_SUFFIX.search(if_none_match)
+        if match:
+            g.etag_encoding = match.group(1)
+            request.environ['HTTP_IF_NONE_MATCH'] = _ENCODED_ETAG_SUFFIX.sub('"', if_none_match)
+
+
+@app.after_request
+def _compress_response(response):
+    """gzip (or brotli) buffered text responses for clients that accept it.
+
+    Streamed responses (exports, static files) and bodies that already carry
+    a Content-Encoding are left alone.
+    """
+    if not COMPRESS_RESPONSES:
+        return response
+    etag, weak = response.get_etag()
+    if response.status_code == 304:
+        # Echo the tag of the variant the client revalidated
+        encoding = g.get('etag_encoding')
+        if etag and not weak and encoding:
+            response.set_etag(f'{etag}-{encoding}')
+        return response
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    body = _compress_body(data, encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    metrics.inc('compressed_response_bytes_total', len(data), encoding=encoding, stage='before')
+    metrics.inc('compressed_response_bytes_total', len(body), encoding=encoding, stage='after')
+    return response
+
+
+# ------------------------
+# Admission control
+# ------------------------
+# Limits are "count/seconds": a bucket holds `count` tokens and refills over
+# `seconds`. "0" disables that limit. State is per worker process, so with N
+# workers a client can get up to N times the budget.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+LOGIN_RATE_PER_IP = os.environ.get('LOGIN_RATE_PER_IP', '30/60')
+# Failed logins per (username, client IP). Only failures are charged and the
+# key includes the IP, so guessing from elsewhere can't lock the owner out
+LOGIN_FAILURES_PER_USERNAME = os.environ.get('LOGIN_FAILURES_PER_USERNAME', '10/60')
+REGISTER_RATE_PER_IP = os.environ.get('REGISTER_RATE_PER_IP', '5/60')
+# Mutations per logged-in user
+WRITE_RATE_PER_USER = os.environ.get('WRITE_RATE_PER_USER', '300/60')
+# Auth and mutation requests in flight at once; more wait ADMISSION_WAIT_SECONDS, then get a 503
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '32'))
+ADMISSION_WAIT_SECONDS = float(os.environ.get('ADMISSION_WAIT_SECONDS', '0.1'))
+RATE_LIMIT_MAX_KEYS = 100_000
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets (key = IP or username), least recently used keys evicted."""
+
+    def __init__(self, capacity: int, period: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec: str):
+        """Parse "count/seconds"; returns None for "0" (limit disabled)."""
+        if spec.strip() == '0':
+            return None
+        count, _, seconds = spec.partition('/')
+        return cls(int(count), float(seconds or 1))
+
+    def acquire(self, key) -> float:
+        """Take a token. Returns 0.0 if admitted, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            admitted = tokens >= 1
+            if admitted:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if admitted else (1 - tokens) / self.rate
+
+    def retry_after(self, key) -> float:
+        """Like acquire(), but only checks: no token is taken."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+
+# kind -> [(label, limiter, key function)]; every admitted request takes a token
+RATE_LIMITS = {
+    'login': [('ip', TokenBucketLimiter.from_spec(LOGIN_RATE_PER_IP), lambda: request.remote_addr)],
+    'register': [('ip', TokenBucketLimiter.from_spec(REGISTER_RATE_PER_IP), lambda: request.remote_addr)],
+    'write': [('user', TokenBucketLimiter.from_spec(WRITE_RATE_PER_USER), lambda: session.get('user_id'))],
+}
+# Checked before a login, charged by login_failed()
+login_failure_limiter = TokenBucketLimiter.from_spec(LOGIN_FAILURES_PER_USERNAME)
+admission_slots = threading.BoundedSemaphore(max(1, ADMISSION_MAX_CONCURRENT))
+
+
+def _submitted_username():
+    data = request.get_json(silent=True) if request.is_json else request.form
+    username = ((data or {}).get('username') or '').strip().lower()
+    return username or None
+
+
+def _login_failure_key():
+    username = _submitted_username()
+    return (username, request.remote_addr) if username else None
+
+
+def login_failed() -> None:
+    """Charge a failed password check to the (username, IP) failure bucket."""
+    key = _login_failure_key()
+    if RATE_LIMIT_ENABLED and login_failure_limiter is not None and key is not None:
+        login_failure_limiter.acquire(key)
+
+
+def _reject(status: int, message: str, retry_after: float):
+    headers = {'Retry-After': str(max(1, math.ceil(retry_after)))}
+    if request.path.startswith('/api/'):
+        return jsonify({"success": False, "message": message}), status, headers
+    return message, status, headers
+
+
+def admission_control(kind: str):
+    """Rate-limit (429) and concurrency-cap (503) the POSTs of an auth or mutation route.
+
+    Buckets are checked first so a rejected client never holds a slot; the
+    slot is held for the whole request (including password hashing).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED or request.method != 'POST':
+                return f(*args, **kwargs)
+            for label, limiter, key_fn in RATE_LIMITS[kind]:
+                key = key_fn() if limiter is not None else None
+                if key is None:
+                    continue
+                retry_after = limiter.acquire(key)
+                if retry_after:
+                    metrics.inc('admission_requests_total', kind=kind, outcome=f'rate_limited_{label}')
+                    return _reject(429, 'Too many requests, please try again later', retry_after)
+            if kind == 'login' and login_failure_limiter is not None:
+                key = _login_failure_key()
+                retry_after = login_failure_limiter.retry_after(key) if key is not None else 0.0
+                if retry_after:
+                    metrics.inc('admission_requests_total', kind=kind, outcome='rate_limited_username')
+                    return _reject(429, 'Too many failed logins, please try again later', retry_after)
+            if not admission_slots.acquire(timeout=ADMISSION_WAIT_SECONDS):
+                metrics.inc('admission_requests_total', kind=kind, outcome='shed')
+                return _reject(503, 'Server busy, please retry', 1)
+            metrics.inc('admission_requests_total', kind=kind, outcome='admitted')
+            try:
+                return f(*args, **kwargs)
+            finally:
+                admission_slots.release()
+        return decorated_function
+    return decorator
+
+
+# ------------------------
+# Principal cache
+# ------------------------
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+# Upper bound on staleness for changes made behind the app's back (e.g. sqlite3 CLI)
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', '60'))
+# One byte is appended per account change; workers compare its size (a stat(),
+# not a query) to notice changes made by other processes
+USERS_SIGNAL_PATH = DB + '.users-signal'
+
+
+class PrincipalCache:
+    """LRU + TTL cache of the logged-in user's {id, username, email, role}, keyed by user_id.
+
+    login_required resolves every request through it, so authorization needs
+    no query while the entry is fresh. invalidate() drops a user in this
+    process and notify() tells the other workers (they clear their caches on
+    their next lookup). Deleted users are cached as None so stale cookies
+    don't hit the database either.
+    """
+
+    def __init__(self, max_size: int, ttl: float, signal_path: str):
+        self._max_size = max(1, max_size)
+        self._ttl = ttl
+        self._signal_path = signal_path
+        self._signal_seen = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped by invalidations; a load that raced one is not stored
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._remote_invalidations = 0
+
+    def _signal_size(self) -> int:
+        try:
+            return os.stat(self._signal_path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def get(self, user_id: int, load):
+        size = self._signal_size()
+        now = time.monotonic()
+        with self._lock:
+            if size != self._signal_seen:
+                if self._signal_seen is not None:
+                    self._remote_invalidations += 1
+                self._signal_seen = size
+                self._entries.clear()
+                self._generation += 1
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+        principal = load(user_id)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[user_id] = (now + self._ttl, principal)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return principal
+
+    def invalidate(self, user_id=None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self._generation += 1
+            self._invalidations += 1
 
-        # Grade distribution (normalize NULL/blank grades to 'Unassigned')
-        grade_rows = conn.execute(
-            """
-            SELECT COALESCE(NULLIF(TRIM(grade), ''), 'Unassigned') AS g, COUNT(*) AS count
-            FROM students
-            GROUP BY g
-            """
-        ).fetchall()
+    def notify(self) -> None:
+        """Signal other processes that account data changed."""
+        try:
+            with open(self._signal_path, 'ab') as f:
+                f.write(b'.')
+        except OSError:
+            # Other workers fall back to the TTL
+            pass
 
-        conn.execute('DELETE FROM grade_stats')
-        for row in grade_rows:
-            conn.execute('INSERT INTO grade_stats (grade, count) VALUES (?, ?)', (row['g'], row['count']))
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self._max_size,
+                'ttl_seconds': self._ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else None,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'remote_invalidations': self._remote_invalidations,
+            }
 
-        conn.commit()
-    finally:
-        conn.close()
 
-# Compute stats once at startup
-recompute_statistics()
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL, USERS_SIGNAL_PATH)
 
-# ------------------------
-# Text export helpers
-# ------------------------
-def export_students_to_text() -> None:
-    conn = get_db_connection()
-    try:
-        rows = conn.execute('SELECT id, roll_number, name, email, subject, marks, grade FROM students ORDER BY roll_number').fetchall()
-        lines = ["ID\tRoll\tName\tEmail\tSubject\tMarks\tGrade"]
-        for r in rows:
-            lines.append(f"{r['id']}\t{r['roll_number']}\t{r['name']}\t{r['email'] or ''}\t{r['subject']}\t{r['marks']}\t{r['grade'] or ''}")
-        _write_text_atomic(STUDENTS_EXPORT, "\n".join(lines) + "\n")
-    finally:
-        conn.close()
 
-def export_users_to_text() -> None:
-    conn = get_db_connection()
-    try:
-        rows = conn.execute('SELECT id, username, email, role FROM users ORDER BY id').fetchall()
-        lines = ["ID\tUsername\tEmail\tRole"]
-        for r in rows:
-            lines.append(f"{r['id']}\t{r['username']}\t{r['email'] or ''}\t{r['role']}")
-        _write_text_atomic(USERS_EXPORT, "\n".join(lines) + "\n")
-    finally:
-        conn.close()
+def _load_principal(user_id: int):
+    with db_connection() as conn:
+        row = conn.execute('SELECT id, username, email, role FROM users WHERE id=?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    return {'id': row['id'], 'username': row['username'], 'email': row['email'], 'role': row['role'] or 'user'}
+
+
+def current_principal():
+    """The logged-in user's cached principal, or None (not logged in / account deleted)."""
+    if 'principal' not in g:
+        user_id = session.get('user_id')
+        g.principal = principal_cache.get(user_id, _load_principal) if user_id is not None else None
+    return g.principal
 
-def append_login_event(user_id: int, username: str, role: str) -> None:
-    from datetime import datetime
-    line = f"{datetime.now().isoformat(timespec='seconds')}\tuser_id={user_id}\tusername={username}\trole={role}\n"
-    # Append and fsync to ensure the event is persisted immediately
-    f = open(LOGIN_EVENTS, 'a', encoding='utf-8')
-    try:
-        f.write(line)
-        f.flush()
-        os.fsync(f.fileno())
-    finally:
-        f.close()
 
-def _write_text_atomic(path: str, content: str) -> None:
-    """Write text to a temp file, fsync, then atomically replace target."""
-    import tempfile
-    dir_name = os.path.dirname(path)
-    with tempfile.NamedTemporaryFile('w', delete=False, dir=dir_name, encoding='utf-8') as tmp:
-        tmp.write(content)
-        tmp.flush()
-        os.fsync(tmp.fileno())
-        tmp_path = tmp.name
-    os.replace(tmp_path, path)
-
-# Initialize exports at startup
-export_students_to_text()
-export_users_to_text()
 # Login required decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
+        principal = current_principal()
+        if principal is None:
+            # Account was deleted since this session was issued
+            session.clear()
+            return redirect(url_for('login'))
+        # Templates read these from the session; only rewrite the cookie when they changed
+        for key in ('username', 'role'):
+            if session.get(key) != principal[key]:
+                session[key] = principal[key]
         return f(*args, **kwargs)
     return decorated_function
 
@@ -212,15 +2516,15 @@ def home():
 
 # Login route
 @app.route('/login', methods=['GET','POST'])
+@admission_control('login')
 def login():
     if request.method == 'POST':
         identifier = request.form['username'].strip()
         password = request.form['password']
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE username=? OR email=?', (identifier, identifier)).fetchone()
-        conn.close()
+        conn = get_db()
+        user = _authenticate(conn, identifier, password)
 
-        if user and check_password_hash(user['password_hash'], password):
+        if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role'] if 'role' in user.keys() else 'user'
@@ -231,6 +2535,7 @@ def login():
                 pass
             return redirect(url_for('dashboard'))
         else:
+            login_failed()
             flash('Invalid username or password', 'danger')
             return render_template('login.html')
     return render_template('login.html')
@@ -239,6 +2544,7 @@ def login():
 # Sign Up route
 @app.route('/signup', methods=['GET', 'POST'])
 @app.route('/register', methods=['GET', 'POST'])
+@admission_control('register')
 def signup():
     if request.method == 'POST':
         username = request.form['username'].strip()
@@ -254,21 +2560,16 @@ def signup():
             flash('Passwords do not match', 'danger')
             return render_template('signup.html')
 
-        conn = get_db_connection()
+        conn = get_db()
         existing = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
         if existing:
-            conn.close()
             flash('Username already taken', 'danger')
             return render_template('signup.html')
 
-        pw_hash = generate_password_hash(password)
+        pw_hash = hash_password(password)
         conn.execute("INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, 'user')", (username, pw_hash, email or None))
         conn.commit()
-        conn.close()
-        try:
-            export_users_to_text()
-        except Exception:
-            pass
+        _users_changed()
         flash('Account created successfully. Please log in.', 'success')
         return redirect(url_for('login'))
 
@@ -277,9 +2578,10 @@ def signup():
 
 @app.route('/account', methods=['GET', 'POST'])
 @login_required
+@admission_control('write')
 def account():
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+    conn = get_db()
+    user = current_principal()
 
     if request.method == 'POST':
         new_username = request.form.get('username')
@@ -297,7 +2599,7 @@ def account():
                 flash("Username updated successfully", "success")
 
         if new_password:
-            hashed_pw = generate_password_hash(new_password)
+            hashed_pw = hash_password(new_password)
             conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (hashed_pw, user['id']))
             flash("Password updated successfully", "success")
 
@@ -306,15 +2608,15 @@ def account():
             flash("Email updated successfully", "success")
 
         conn.commit()
-        conn.close()
+        _users_changed(user['id'])
         return redirect(url_for('account'))
 
-    conn.close()
     return render_template('account.html', user=user)
 
 
 # API: Register (JSON)
 @app.route('/api/register', methods=['POST'])
+@admission_control('register')
 def api_register():
     if not request.is_json:
         return jsonify({"success": False, "message": "Expected JSON body"}), 400
@@ -327,22 +2629,22 @@ def api_register():
     if not username or not password:
         return jsonify({"success": False, "message": "Username and password are required"}), 400
 
-    conn = get_db_connection()
+    conn = get_db()
     existing = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
     if existing:
-        conn.close()
         return jsonify({"success": False, "message": "Username already taken"}), 409
 
-    pw_hash = generate_password_hash(password)
+    pw_hash = hash_password(password)
     conn.execute('INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)', (username, pw_hash, email))
     conn.commit()
-    conn.close()
+    _users_changed()
 
     return jsonify({"success": True, "message": "Account created"}), 201
 
 
 # API: Login (JSON)
 @app.route('/api/login', methods=['POST'])
+@admission_control('login')
 def api_login():
     if not request.is_json:
         return jsonify({"success": False, "message": "Expected JSON body"}), 400
@@ -354,11 +2656,10 @@ def api_login():
     if not username or not password:
         return jsonify({"success": False, "message": "Username and password are required"}), 400
 
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE username=? OR email=?', (username, username)).fetchone()
-    conn.close()
+    conn = get_db()
+    user = _authenticate(conn, username, password)
 
-    if user and check_password_hash(user['password_hash'], password):
+    if user:
         session['user_id'] = user['id']
         session['username'] = user['username']
         session['role'] = user['role'] if 'role' in user.keys() else 'user'
@@ -368,16 +2669,18 @@ def api_login():
             "user": {"id": user['id'], "username": user['username'], "email": user['email'], "role": (user['role'] if 'role' in user.keys() else 'user')}
         }), 200
 
+    login_failed()
     return jsonify({"success": False, "message": "Invalid username or password"}), 401
 
 # Delete current account
 @app.route('/account/delete', methods=['POST'])
 @login_required
+@admission_control('write')
 def delete_account():
-    conn = get_db_connection()
+    conn = get_db()
     conn.execute('DELETE FROM users WHERE id = ?', (session['user_id'],))
     conn.commit()
-    conn.close()
+    _users_changed(session['user_id'])
     session.clear()
     flash('Your account has been deleted', 'info')
     return redirect(url_for('login'))
@@ -395,36 +2698,19 @@ def logout():
 # Add student
 @app.route('/add', methods=['GET','POST'])
 @login_required
+@admission_control('write')
 def add_student():
     if request.method == 'POST':
-        roll_number = request.form['roll_number'].strip()
-        name = request.form['name'].strip()
-        email = request.form['email'].strip()
-        subject = request.form['subject'].strip()
-        marks = request.form['marks'].strip()
-        grade = request.form['grade'].strip()
-
-        if not (roll_number and name and subject and marks):
-            flash('Please fill required fields', 'warning')
-            return render_template('add.html')
-
-        try:
-            marks_int = int(marks)
-        except ValueError:
-            flash('Marks must be an integer', 'warning')
+        student, error = _clean_student(request.form)
+        if error:
+            flash(error, 'warning')
             return render_template('add.html')
 
-        conn = get_db_connection()
-        conn.execute('INSERT INTO students (roll_number, name, email, subject, marks, grade) VALUES (?, ?, ?, ?, ?, ?)',
-                     (roll_number, name, email or None, subject, marks_int, grade or None))
-        conn.commit()
-        conn.close()
-        # Update aggregate stats after insert
-        recompute_statistics()
-        try:
-            export_students_to_text()
-        except Exception:
-            pass
+        conn = get_db()
+        with _write_transaction(conn):
+            # Aggregate stats are updated incrementally in the same transaction
+            _insert_student_row(conn, student)
+        _students_changed()
         flash('Student added successfully', 'success')
         return redirect(url_for('dashboard'))
 
@@ -433,62 +2719,37 @@ def add_student():
 # Edit student
 @app.route('/edit/<int:id>', methods=['GET','POST'])
 @login_required
+@admission_control('write')
 def edit_student(id):
-    conn = get_db_connection()
+    conn = get_db()
     student = conn.execute('SELECT * FROM students WHERE id=?', (id,)).fetchone()
     if not student:
-        conn.close()
         flash('Record not found', 'danger')
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
-        roll_number = request.form['roll_number'].strip()
-        name = request.form['name'].strip()
-        email = request.form['email'].strip()
-        subject = request.form['subject'].strip()
-        marks = request.form['marks'].strip()
-        grade = request.form['grade'].strip()
-
-        if not (roll_number and name and subject and marks):
-            flash('Please fill required fields', 'warning')
-            return render_template('edit.html', student=student)
-
-        try:
-            marks_int = int(marks)
-        except ValueError:
-            flash('Marks must be an integer', 'warning')
+        updated, error = _clean_student(request.form)
+        if error:
+            flash(error, 'warning')
             return render_template('edit.html', student=student)
 
-        conn.execute('UPDATE students SET roll_number=?, name=?, email=?, subject=?, marks=?, grade=? WHERE id=?',
-                     (roll_number, name, email or None, subject, marks_int, grade or None, id))
-        conn.commit()
-        conn.close()
-        # Update aggregate stats after update
-        recompute_statistics()
-        try:
-            export_students_to_text()
-        except Exception:
-            pass
+        with _write_transaction(conn):
+            _update_student_row(conn, id, updated)
+        _students_changed()
         flash('Student updated successfully', 'success')
         return redirect(url_for('dashboard'))
 
-    conn.close()
     return render_template('edit.html', student=student)
 
 # Delete student
 @app.route('/delete/<int:id>', methods=['POST'])
 @login_required
+@admission_control('write')
 def delete_student(id):
-    conn = get_db_connection()
-    conn.execute('DELETE FROM students WHERE id=?', (id,))
-    conn.commit()
-    conn.close()
-    # Update aggregate stats after delete
-    recompute_statistics()
-    try:
-        export_students_to_text()
-    except Exception:
-        pass
+    conn = get_db()
+    with _write_transaction(conn):
+        _delete_student_row(conn, id)
+    _students_changed()
     flash('Student record deleted', 'info')
     return redirect(url_for('dashboard'))
 
@@ -496,9 +2757,8 @@ def delete_student(id):
 @app.route('/student/<int:id>', methods=['GET'])
 @login_required
 def student_detail(id):
-    conn = get_db_connection()
+    conn = get_db()
     student = conn.execute('SELECT * FROM students WHERE id=?', (id,)).fetchone()
-    conn.close()
     if not student:
         flash('Student not found', 'warning')
         return redirect(url_for('dashboard'))
@@ -507,68 +2767,1117 @@ def student_detail(id):
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Always refresh stats when dashboard loads
-    recompute_statistics()
+    """Dashboard page assembled from fragments cached per data version.
 
-    conn = get_db_connection()
-    students = conn.execute('SELECT * FROM students ORDER BY roll_number').fetchall()
-    # Distinct subjects (used as branches/classes for filtering in UI)
-    subject_rows = conn.execute('SELECT DISTINCT subject FROM students ORDER BY subject').fetchall()
-    subjects = [row['subject'] for row in subject_rows if (row['subject'] or '').strip()]
+    Student rows are loaded lazily by the page from /api/students. The page
+    carries a strong ETag over its body, so an unchanged dashboard is a 304.
+    """
+    # Role comes from the principal cache (kept current on role changes), not the cookie
+    is_admin = current_principal()['role'] == 'admin'
 
-    # Determine admin privileges robustly from DB (not just session)
-    current_user = None
-    if 'user_id' in session:
-        current_user = conn.execute('SELECT role FROM users WHERE id=?', (session['user_id'],)).fetchone()
-    is_admin = bool(current_user and (current_user['role'] == 'admin'))
-    if is_admin:
-        session['role'] = 'admin'
+    body = render_template('dashboard.html', is_admin=is_admin, fragments=dashboard_fragments(),
+                           live_updates=DASHBOARD_LIVE_UPDATES, live_wait=DASHBOARD_LIVE_WAIT)
+    response = app.response_class(body, mimetype='text/html')
+    response.set_etag(hashlib.sha1(body.encode('utf-8')).hexdigest())
+    # The page embeds the username and flashed messages
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
 
+
+# Rendered once per students_version and shared by every user's dashboard
+DASHBOARD_FRAGMENTS = ('summary_cards', 'subject_options', 'chart_data')
+dashboard_cache = VersionedCache(source=aggregates_shared_version)
+
+
+def _render_dashboard_fragments() -> dict:
+    with db_connection() as conn:
+        summary = analytics_summary(conn)
+    return {name: get_template_attribute('_dashboard_fragments.html', name)(summary)
+            for name in DASHBOARD_FRAGMENTS}
+
+
+def dashboard_fragments() -> dict:
+    return dashboard_cache.get('fragments', _render_dashboard_fragments)
+
+
+def _analytics_from_sql(conn) -> dict:
     s = conn.execute('SELECT total_students, avg_marks, highest_marks, lowest_marks FROM stats WHERE id=1').fetchone()
-    total_students = s['total_students'] if s else 0
-    avg_marks = s['avg_marks'] if s else None
-    highest_marks = s['highest_marks'] if s else None
-    lowest_marks = s['lowest_marks'] if s else None
-
-    grade_data = conn.execute('SELECT grade, count FROM grade_stats').fetchall()
-
-    conn.close()
-
-    return render_template(
-        'dashboard.html',
-        students=students,
-        total_students=total_students,
-        avg_marks=avg_marks,
-        highest_marks=highest_marks,
-        lowest_marks=lowest_marks,
-        grade_data=grade_data,
-        is_admin=is_admin,
-        subjects=subjects
-    )
+    subject_rows = conn.execute('SELECT DISTINCT subject FROM students ORDER BY subject').fetchall()
+    return {
+        'total_students': s['total_students'] if s else 0,
+        'avg_marks': s['avg_marks'] if s else None,
+        'highest_marks': s['highest_marks'] if s else None,
+        'lowest_marks': s['lowest_marks'] if s else None,
+        'grade_distribution': [dict(row) for row in conn.execute('SELECT grade, count FROM grade_stats ORDER BY grade').fetchall()],
+        'subjects': [row['subject'] for row in subject_rows if (row['subject'] or '').strip()],
+    }
+
+
+def analytics_summary(conn) -> dict:
+    """Totals, grade distribution and subject list for dashboard() / stats_api()."""
+    if student_snapshot.enabled:
+        return student_snapshot.aggregates()
+    return _analytics_from_sql(conn)
+
+# Students API (JSON, keyset pagination)
+STUDENT_SORT_COLUMNS = ('roll_number', 'name', 'marks')
+STUDENTS_PAGE_DEFAULT = 50
+STUDENTS_PAGE_MAX = 500
+
+
+def _encode_cursor(sort_value, row_id) -> str:
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+# Python type a cursor's sort value must have for each sort column
+STUDENT_SORT_TYPES = {'roll_number': (str,), 'name': (str,), 'marks': (int, float)}
+
+
+def _decode_cursor(cursor: str, sort: str):
+    """Decode a next_cursor for `sort`; ValueError unless it is [sort value, id] of the right types."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    # bool is an int subclass; lists/dicts would reach sqlite3 as bad parameters
+    if (not isinstance(row_id, int) or isinstance(row_id, bool)
+            or not isinstance(sort_value, STUDENT_SORT_TYPES[sort]) or isinstance(sort_value, bool)):
+        raise ValueError('cursor does not match the sort column')
+    return sort_value, row_id
+
+
+@app.route('/api/students', methods=['GET'])
+@login_required
+def students_api():
+    """One page of students ordered by (sort column, id).
+
+    Query params: limit, subject, sort (roll_number|name|marks), order (asc|desc)
+    and cursor (the `next_cursor` of the previous page). Every combination is
+    served by one of the (subject?, sort, id) indexes created by MIGRATIONS.
+    """
+    sort = request.args.get('sort', 'roll_number')
+    if sort not in STUDENT_SORT_COLUMNS:
+        return jsonify({"success": False, "message": f"sort must be one of {', '.join(STUDENT_SORT_COLUMNS)}"}), 400
+    order = request.args.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        return jsonify({"success": False, "message": "order must be asc or desc"}), 400
+    try:
+        limit = int(request.args.get('limit', STUDENTS_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    limit = max(1, min(limit, STUDENTS_PAGE_MAX))
+
+    where = []
+    params = []
+    subject = (request.args.get('subject') or '').strip()
+    if subject:
+        where.append('subject = ?')
+        params.append(subject)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after_value, after_id = _decode_cursor(cursor, sort)
+        except (ValueError, TypeError, binascii.Error):
+            return jsonify({"success": False, "message": "Invalid cursor"}), 400
+        where.append(f"({sort}, id) {'>' if order == 'asc' else '<'} (?, ?)")
+        params.extend([after_value, after_id])
+
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    sql = 'SELECT id, roll_number, name, email, subject, marks, grade FROM students'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {sort} {direction}, id {direction} LIMIT ?'
+    params.append(limit + 1)
+
+    conn = get_db()
+    rows = conn.execute(sql, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(rows[-1][sort], rows[-1]['id']) if has_more else None
+    return jsonify({
+        "success": True,
+        "students": [dict(row) for row in rows],
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }), 200
+
+
+# Search API (JSON, full-text)
+SEARCH_LIMIT_DEFAULT = 10
+SEARCH_LIMIT_MAX = 100
+
+
+def _fts_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every term must match as a prefix."""
+    terms = [t.replace('"', '') for t in q.split()]
+    return ' '.join(f'"{t}"*' for t in terms if t)
+
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_api():
+    """Ranked prefix search over roll number, name, email and subject.
+
+    Query params: q, limit (default 10, max 100) and an optional subject filter.
+    """
+    q = (request.args.get('q') or '').strip()
+    try:
+        limit = int(request.args.get('limit', SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be an integer"}), 400
+    limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+    subject = (request.args.get('subject') or '').strip()
+
+    match = _fts_query(q)
+    if not match:
+        return jsonify({"success": True, "results": []}), 200
+
+    conn = get_db()
+    if FTS_AVAILABLE:
+        # bm25 weights favour roll number and name hits over email/subject
+        sql = (
+            'SELECT s.id, s.roll_number, s.name, s.email, s.subject, s.marks, s.grade '
+            'FROM students_fts JOIN students s ON s.id = students_fts.rowid '
+            'WHERE students_fts MATCH ?'
+        )
+        params = [match]
+        if subject:
+            sql += ' AND s.subject = ?'
+            params.append(subject)
+        sql += ' ORDER BY bm25(students_fts, 5.0, 3.0, 1.0, 1.0) LIMIT ?'
+        params.append(limit)
+    else:
+        sql = 'SELECT id, roll_number, name, email, subject, marks, grade FROM students WHERE 1=1'
+        params = []
+        for term in q.split():
+            sql += ' AND (roll_number LIKE ? OR name LIKE ? OR email LIKE ? OR subject LIKE ?)'
+            params.extend([f'{term}%'] * 4)
+        if subject:
+            sql += ' AND subject = ?'
+            params.append(subject)
+        sql += ' ORDER BY roll_number, id LIMIT ?'
+        params.append(limit)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError:
+        return jsonify({"success": False, "message": "Invalid search query"}), 400
+
+    return jsonify({"success": True, "results": [dict(row) for row in rows]}), 200
+
+
+# Bulk import (CSV/TSV upload or raw body)
+@app.route('/api/students/import', methods=['POST'])
+@login_required
+@admission_control('write')
+def import_students_api():
+    """Import students from an uploaded `file` field or a raw CSV/TSV request body.
+
+    Optional query params: delimiter (tab|comma), chunk_size.
+    """
+    delimiter = {'tab': '\t', 'comma': ','}.get(request.args.get('delimiter', ''))
+    try:
+        chunk_size = max(1, int(request.args.get('chunk_size', IMPORT_CHUNK_SIZE)))
+    except ValueError:
+        return jsonify({"success": False, "message": "chunk_size must be an integer"}), 400
+
+    upload = request.files.get('file')
+    raw = upload.stream if upload else request.stream
+    report = import_students(utf8_lines(raw), delimiter=delimiter, chunk_size=chunk_size)
+
+    status = 200 if (report['inserted'] or not report['errors']) and not report['aborted'] else 400
+    return jsonify({"success": status == 200, "report": report}), status
+
+
+# Batch mutations (JSON)
+@app.route('/api/students/batch', methods=['POST'])
+@login_required
+@admission_control('write')
+def students_batch_api():
+    """Apply a list of student operations in one transaction; see apply_student_batch().
+
+    Body: {"ops": [...], "atomic": true}. Returns per-op results in input order.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Body must be a JSON object with an ops list"}), 400
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"success": False, "message": "ops must be a non-empty list"}), 400
+    if len(ops) > BATCH_MAX_OPS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_OPS} ops per batch"}), 413
+
+    report = apply_student_batch(ops, atomic=data.get('atomic', True) is not False)
+    status = 200 if report['committed'] else 400
+    return jsonify({"success": report['committed'], **report}), status
+
+
+# Export writer status (JSON)
+@app.route('/api/exports', methods=['GET'])
+@login_required
+def exports_api():
+    return jsonify({'success': True, 'exports': {
+        'students': students_exporter.metrics(),
+        'users': users_exporter.metrics(),
+        'login_events': login_event_writer.metrics(),
+    }}), 200
+
+
+# Principal cache stats (JSON)
+@app.route('/api/auth/principals', methods=['GET'])
+@login_required
+def principals_api():
+    return jsonify({'success': True, 'principal_cache': principal_cache.stats()}), 200
+
+
+# Password hashing stats (JSON)
+@app.route('/api/auth/hashing', methods=['GET'])
+@login_required
+def hashing_api():
+    return jsonify({'success': True, 'hashing': password_hasher.stats()}), 200
+
+
+# Analytics snapshot status and memory footprint (JSON)
+@app.route('/api/analytics/snapshot', methods=['GET'])
+@login_required
+def snapshot_api():
+    return jsonify({'success': True, 'snapshot': student_snapshot.stats()}), 200
+
+
+# Prometheus metrics (text exposition format)
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return 'metrics disabled\n', 404
+    authorization = request.headers.get('Authorization', '')
+    if not (METRICS_TOKEN and hmac.compare_digest(authorization.encode(), f'Bearer {METRICS_TOKEN}'.encode())):
+        # Query labels carry normalized SQL, so this is not public
+        principal = current_principal()
+        if principal is None or principal['role'] != 'admin':
+            return 'forbidden\n', 403
+    lines = []
+    metrics.render(lines)
+
+    for key, value in db_pool.stats().items():
+        if key == 'max_size':
+            continue
+        lines.append(f'db_pool_{key} {value}')
+    for name, worker in (('students', students_exporter), ('users', users_exporter)):
+        for key, value in worker.metrics().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'export_{key}{_prom_labels({"export": name})} {value}')
+            elif isinstance(value, bool):
+                lines.append(f'export_{key}{_prom_labels({"export": name})} {int(value)}')
+    for key, value in login_event_writer.metrics().items():
+        lines.append(f'login_events_{key} {value}')
+    lines.append('# TYPE password_hash_duration_seconds histogram')
+    for op, hist in password_hasher.latency.items():
+        _prom_histogram(lines, 'password_hash_duration_seconds', {'op': op}, hist.snapshot())
+
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+# ------------------------
+# Streaming exports
+# ------------------------
+EXPORT_FETCH_SIZE = 1000
+# Downloads stream from their own connection, outside db_pool, so slow
+# clients can't starve requests; this caps how many run at once (503 beyond)
+EXPORT_MAX_CONCURRENT = int(os.environ.get('EXPORT_MAX_CONCURRENT', '4'))
+export_slots = threading.BoundedSemaphore(max(1, EXPORT_MAX_CONCURRENT))
+EXPORT_COLUMNS = ('id', 'roll_number', 'name', 'email', 'subject', 'marks', 'grade')
+EXPORT_STRING_COLUMNS = ('roll_number', 'name', 'email', 'subject', 'grade')
+# Columnar format stores low-cardinality columns dictionary-encoded
+COLUMNAR_PLAIN_COLUMNS = ('roll_number', 'name', 'email')
+COLUMNAR_DICT_COLUMNS = ('subject', 'grade')
+COLUMNAR_MAGIC = b'SMCOL1\n'
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'columnar': 'application/octet-stream',
+}
+EXPORT_EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'columnar': 'smcol'}
+
+
+def _iter_student_batches(sql: str, params: list):
+    """Yield lists of rows from a server-side cursor, EXPORT_FETCH_SIZE at a time.
+
+    Uses a dedicated connection rather than a pool slot: the generator lives
+    as long as the download, however slowly the client reads it.
+    """
+    conn = get_db_connection()
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def _release_once(semaphore):
+    lock = threading.Lock()
+    held = [True]
+
+    def release():
+        with lock:
+            if held:
+                held.pop()
+                semaphore.release()
+    return release
+
+
+def _releasing(chunks, release):
+    try:
+        yield from chunks
+    finally:
+        release()
+
+
+def _csv_chunks(batches):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(tuple(row) for row in rows)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(row), separators=(',', ':')) + '\n' for row in rows).encode('utf-8')
+
+
+def _pack_ints(values, signed: bool) -> bytes:
+    """Pack ints at the narrowest width that fits: a struct format byte, then the array."""
+    lo, hi = (min(values), max(values)) if values else (0, 0)
+    for code, bits in (('b', 8), ('h', 16), ('i', 32), ('q', 64)):
+        if signed and -(1 << (bits - 1)) <= lo and hi < (1 << (bits - 1)):
+            break
+        if not signed and lo >= 0 and hi < (1 << bits):
+            code = code.upper()
+            break
+    return code.encode('ascii') + struct.pack(f'<{len(values)}{code}', *values)
+
+
+def _unpack_ints(data: bytes, pos: int, n: int):
+    code = chr(data[pos])
+    values = struct.unpack_from(f'<{n}{code}', data, pos + 1)
+    return values, pos + 1 + struct.calcsize(f'<{n}{code}')
+
+
+def _pack_strings(values) -> bytes:
+    """Null bitmap, packed UTF-8 lengths, then the concatenated UTF-8 bytes."""
+    n = len(values)
+    bitmap = bytearray((n + 7) // 8)
+    encoded = []
+    for i, value in enumerate(values):
+        if value is None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+            encoded.append(b'')
+        else:
+            encoded.append(str(value).encode('utf-8'))
+    return bytes(bitmap) + _pack_ints([len(e) for e in encoded], signed=False) + b''.join(encoded)
+
+
+def _unpack_strings(data: bytes, pos: int, n: int):
+    bitmap = data[pos:pos + (n + 7) // 8]
+    lengths, pos = _unpack_ints(data, pos + (n + 7) // 8, n)
+    out = []
+    for i, length in enumerate(lengths):
+        out.append(None if bitmap[i >> 3] & (1 << (i & 7)) else data[pos:pos + length].decode('utf-8'))
+        pos += length
+    return out, pos
+
+
+def _columnar_chunks(batches):
+    """Compact column-oriented binary stream ("SMCOL1"). All integers little-endian.
+
+    Layout: the 7-byte magic, then one block per fetch batch and a final
+    block with row count 0. A block is `uint32 n` followed by:
+      id           first id (int64) + deltas to the previous id (int array)
+      marks        int array
+      roll_number, name, email
+                   string array
+      subject, grade
+                   dictionary: uint32 size + string array of distinct values,
+                   then an int array of codes into it
+    An int array is one struct format byte (b/B/h/H/i/I/q/Q, narrowest that
+    fits the block) followed by the packed values. A string array is a null
+    bitmap (ceil(n/8) bytes, bit i set = NULL), an int array of UTF-8 byte
+    lengths and the concatenated UTF-8 bytes.
+    See decode_students_columnar() for a reader.
+    """
+    yield COLUMNAR_MAGIC
+    for rows in batches:
+        n = len(rows)
+        ids = [row['id'] for row in rows]
+        parts = [struct.pack('<Iq', n, ids[0]),
+                 _pack_ints([b - a for a, b in zip(ids, ids[1:])], signed=True),
+                 _pack_ints([row['marks'] for row in rows], signed=True)]
+        for column in COLUMNAR_PLAIN_COLUMNS:
+            parts.append(_pack_strings([row[column] for row in rows]))
+        for column in COLUMNAR_DICT_COLUMNS:
+            dictionary = {}
+            codes = [dictionary.setdefault(row[column], len(dictionary)) for row in rows]
+            parts += [struct.pack('<I', len(dictionary)), _pack_strings(list(dictionary)),
+                      _pack_ints(codes, signed=False)]
+        yield b''.join(parts)
+    yield struct.pack('<I', 0)
+
+
+def decode_students_columnar(data: bytes) -> list:
+    """Decode an SMCOL1 export back into a list of row dicts."""
+    if not data.startswith(COLUMNAR_MAGIC):
+        raise ValueError('Not an SMCOL1 stream')
+    pos = len(COLUMNAR_MAGIC)
+    out = []
+    while True:
+        (n,) = struct.unpack_from('<I', data, pos)
+        pos += 4
+        if n == 0:
+            return out
+        (first_id,) = struct.unpack_from('<q', data, pos)
+        deltas, pos = _unpack_ints(data, pos + 8, n - 1)
+        ids = list(itertools.accumulate(deltas, initial=first_id))
+        marks, pos = _unpack_ints(data, pos, n)
+        columns = {}
+        for column in COLUMNAR_PLAIN_COLUMNS:
+            columns[column], pos = _unpack_strings(data, pos, n)
+        for column in COLUMNAR_DICT_COLUMNS:
+            (size,) = struct.unpack_from('<I', data, pos)
+            dictionary, pos = _unpack_strings(data, pos + 4, size)
+            codes, pos = _unpack_ints(data, pos, n)
+            columns[column] = [dictionary[c] for c in codes]
+        for i in range(n):
+            row = {'id': ids[i], 'marks': marks[i]}
+            row.update({column: columns[column][i] for column in EXPORT_STRING_COLUMNS})
+            out.append(row)
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+EXPORT_ENCODERS = {'csv': _csv_chunks, 'ndjson': _ndjson_chunks, 'columnar': _columnar_chunks}
+
+
+@app.route('/api/export/students', methods=['GET'])
+@login_required
+def export_students_api():
+    """Stream students as csv, ndjson or columnar with constant memory.
+
+    Query params: format (csv|ndjson|columnar, default csv), gzip=1, subject,
+    min_marks, max_marks. Filters run in SQL; rows are read from the cursor in
+    batches and encoded as they are sent.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_ENCODERS:
+        return jsonify({"success": False, "message": f"format must be one of {', '.join(EXPORT_ENCODERS)}"}), 400
+
+    where = []
+    params = []
+    subject = (request.args.get('subject') or '').strip()
+    if subject:
+        where.append('subject = ?')
+        params.append(subject)
+    for arg, op in (('min_marks', '>='), ('max_marks', '<=')):
+        value = request.args.get(arg)
+        if value not in (None, ''):
+            try:
+                params.append(int(value))
+            except ValueError:
+                return jsonify({"success": False, "message": f"{arg} must be an integer"}), 400
+            where.append(f'marks {op} ?')
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM students"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY id'
+
+    if not export_slots.acquire(blocking=False):
+        metrics.inc('export_requests_rejected_total')
+        return jsonify({"success": False, "message": "Too many exports in progress, please retry"}), 503, {'Retry-After': '5'}
+    release = _release_once(export_slots)
+    chunks = _releasing(EXPORT_ENCODERS[fmt](_iter_student_batches(sql, params)), release)
+    headers = {'Content-Disposition': f'attachment; filename=students.{EXPORT_EXTENSIONS[fmt]}'}
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        chunks = _gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    response = app.response_class(chunks, mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+    # The slot is freed when the stream ends, or on close if it never started
+    response.call_on_close(release)
+    return response
+
+
+# Connection pool stats (JSON)
+@app.route('/api/db/pool', methods=['GET'])
+@login_required
+def db_pool_api():
+    return jsonify({'success': True, 'pool': db_pool.stats()}), 200
+
+
+# Rollup analytics API (JSON)
+ROLLUP_PERCENTILES = (25, 50, 75, 90)
+
+
+def _histogram_percentiles(histogram, total: int, percentiles=ROLLUP_PERCENTILES) -> dict:
+    """Nearest-rank percentiles from an ascending [(marks, count), ...] histogram."""
+    result = {}
+    if total <= 0:
+        return {f'p{p}': None for p in percentiles}
+    for p in percentiles:
+        rank = max(1, math.ceil(p / 100 * total))
+        seen = 0
+        for marks, count in histogram:
+            seen += count
+            if seen >= rank:
+                result[f'p{p}'] = marks
+                break
+    return result
+
+
+def _rollup_payload(row, histogram) -> dict:
+    return {
+        'count': row['count'],
+        'sum_marks': row['sum_marks'],
+        'avg_marks': (row['sum_marks'] / row['count']) if row['count'] else None,
+        'min_marks': row['min_marks'],
+        'max_marks': row['max_marks'],
+        'percentiles': _histogram_percentiles(histogram, row['count']),
+        'histogram': [{'marks': m, 'count': c} for m, c in histogram],
+    }
+
+
+def _build_subject_rollups() -> list:
+    with db_connection() as conn:
+        rows = conn.execute("SELECT key, count, sum_marks, min_marks, max_marks FROM rollups WHERE dimension='subject' ORDER BY key").fetchall()
+        hist_rows = conn.execute("SELECT key, marks, count FROM rollup_histogram WHERE dimension='subject' ORDER BY key, marks").fetchall()
+    histograms = {}
+    for h in hist_rows:
+        histograms.setdefault(h['key'], []).append((h['marks'], h['count']))
+    return [dict(subject=row['key'], **_rollup_payload(row, histograms.get(row['key'], []))) for row in rows]
+
+
+def _build_student_rollup(roll_number: str):
+    with db_connection() as conn:
+        row = conn.execute("SELECT key, count, sum_marks, min_marks, max_marks FROM rollups WHERE dimension='student' AND key=?", (roll_number,)).fetchone()
+        if row is None:
+            return None
+        hist_rows = conn.execute("SELECT marks, count FROM rollup_histogram WHERE dimension='student' AND key=? ORDER BY marks", (roll_number,)).fetchall()
+    payload = _rollup_payload(row, [(h['marks'], h['count']) for h in hist_rows])
+    payload['total_marks'] = payload.pop('sum_marks')
+    return dict(roll_number=roll_number, **payload)
+
+
+@app.route('/api/stats/subjects', methods=['GET'])
+@login_required
+def subject_stats_api():
+    """Per-subject count/sum/avg/min/max, approximate percentiles and marks histogram."""
+    return jsonify({'success': True, 'subjects': stats_cache.get('subjects', _build_subject_rollups)}), 200
+
+
+# Keyed by roll numbers from the URL: bounded, and unknown rolls aren't cached
+STUDENT_ROLLUP_CACHE_SIZE = 4096
+student_rollup_cache = VersionedCache(source=aggregates_shared_version, max_entries=STUDENT_ROLLUP_CACHE_SIZE)
+
+
+@app.route('/api/stats/students/<roll>', methods=['GET'])
+@login_required
+def student_stats_api(roll):
+    """Totals across all subjects for one roll number."""
+    rollup = student_rollup_cache.get(roll, lambda: _build_student_rollup(roll))
+    if rollup is None:
+        return jsonify({'success': False, 'message': 'Roll number not found'}), 404
+    return jsonify({'success': True, 'student': rollup}), 200
+
+
+# ------------------------
+# Rank / leaderboard
+# ------------------------
+LEADERBOARD_DEFAULT = 50
+LEADERBOARD_MAX = 500
+
+
+class SubjectRanking:
+    """Order statistics for one subject, built from its rollup_histogram rows.
+
+    Distinct marks are kept ascending next to cumulative counts, so rank,
+    percentile and "n-th best" lookups are a bisect: O(log D) for D distinct
+    marks, however many students the subject has. Ties share a rank
+    (competition ranking: 1, 2, 2, 4).
+    """
+
+    __slots__ = ('values', 'cumulative', 'total')
+
+    def __init__(self, histogram):
+        # histogram: ascending [(marks, count), ...]
+        self.values = [marks for marks, _ in histogram]
+        # cumulative[i] = number of students with marks <= values[i]
+        self.cumulative = list(itertools.accumulate(count for _, count in histogram))
+        self.total = self.cumulative[-1] if self.cumulative else 0
+
+    def count_above(self, marks) -> int:
+        i = bisect.bisect_right(self.values, marks)
+        return self.total - (self.cumulative[i - 1] if i else 0)
+
+    def count_below(self, marks) -> int:
+        i = bisect.bisect_left(self.values, marks)
+        return self.cumulative[i - 1] if i else 0
+
+    def rank(self, marks) -> int:
+        return self.count_above(marks) + 1
+
+    def percentile(self, marks):
+        """Percentile rank: share of the subject below `marks`, counting ties as half."""
+        if not self.total:
+            return None
+        below = self.count_below(marks)
+        equal = self.total - below - self.count_above(marks)
+        return round(100.0 * (below + equal / 2) / self.total, 2)
+
+    def nth_best(self, n: int):
+        """Marks of the student at 0-based position `n` in descending order."""
+        if not 0 <= n < self.total:
+            return None
+        return self.values[bisect.bisect_right(self.cumulative, self.total - 1 - n)]
+
+    def bands(self) -> dict:
+        """Marks cutoffs for the percentile bands, e.g. p90 = lowest score in the top 10%."""
+        counts = [c - (self.cumulative[i - 1] if i else 0) for i, c in enumerate(self.cumulative)]
+        return _histogram_percentiles(list(zip(self.values, counts)), self.total)
+
+
+def _build_subject_ranking(subject: str) -> SubjectRanking:
+    with db_connection() as conn:
+        rows = conn.execute("SELECT marks, count FROM rollup_histogram WHERE dimension='subject' AND key=? ORDER BY marks",
+                            (subject,)).fetchall()
+    # None for an unknown subject so made-up names from the URL aren't cached
+    return SubjectRanking([(row['marks'], row['count']) for row in rows]) if rows else None
+
+
+# Per-subject SubjectRanking objects; rebuilt lazily (one small PK range scan)
+# after a students write in any worker
+RANKING_CACHE_SIZE = 1024
+ranking_cache = VersionedCache(source=aggregates_shared_version, max_entries=RANKING_CACHE_SIZE)
+
+
+def subject_ranking(subject: str) -> SubjectRanking:
+    return ranking_cache.get(subject, lambda: _build_subject_ranking(subject)) or SubjectRanking([])
+
+
+@app.route('/api/leaderboard/<subject>', methods=['GET'])
+@login_required
+def leaderboard_api(subject):
+    """Students of one subject from the top, with rank and percentile.
+
+    Query params: limit, offset (a rank position, e.g. from `next_offset`).
+    The marks at `offset` come from the in-memory ranking, so deep pages
+    start on the (subject, marks, id) index instead of skipping rows.
+    """
+    try:
+        limit = int(request.args.get('limit', LEADERBOARD_DEFAULT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit and offset must be integers"}), 400
+    limit = max(1, min(limit, LEADERBOARD_MAX))
+    offset = max(0, offset)
+
+    ranking = subject_ranking(subject)
+    if not ranking.total:
+        return jsonify({"success": False, "message": "Subject not found"}), 404
+
+    entries = []
+    start_marks = ranking.nth_best(offset)
+    if start_marks is not None:
+        # Only students tied at start_marks have to be skipped in SQL
+        skip = offset - ranking.count_above(start_marks)
+        conn = get_db()
+        rows = conn.execute(
+            'SELECT id, roll_number, name, marks, grade FROM students WHERE subject=? AND marks<=? '
+            'ORDER BY marks DESC, id LIMIT ? OFFSET ?',
+            (subject, start_marks, limit, skip)
+        ).fetchall()
+        entries = [dict(row, rank=ranking.rank(row['marks']), percentile=ranking.percentile(row['marks'])) for row in rows]
+
+    next_offset = offset + len(entries)
+    return jsonify({
+        'success': True,
+        'subject': subject,
+        'total': ranking.total,
+        'bands': ranking.bands(),
+        'entries': entries,
+        'next_offset': next_offset if next_offset < ranking.total else None,
+    }), 200
+
+
+@app.route('/api/rank/<roll>', methods=['GET'])
+@login_required
+def rank_api(roll):
+    """Rank of a roll number within each of its subjects (or just `?subject=`)."""
+    subject = request.args.get('subject')
+    conn = get_db()
+    sql = 'SELECT id, name, subject, marks, grade FROM students WHERE roll_number=?'
+    params = [roll]
+    if subject:
+        sql += ' AND subject=?'
+        params.append(subject)
+    rows = conn.execute(sql + ' ORDER BY subject, id', params).fetchall()
+    if not rows:
+        return jsonify({"success": False, "message": "Roll number not found"}), 404
+
+    ranks = []
+    for row in rows:
+        ranking = subject_ranking(row['subject'])
+        ranks.append(dict(row, rank=ranking.rank(row['marks']), out_of=ranking.total,
+                          percentile=ranking.percentile(row['marks'])))
+    return jsonify({'success': True, 'roll_number': roll, 'ranks': ranks}), 200
+
+
+# ------------------------
+# Change feed
+# ------------------------
+# change_log is kept to the newest CHANGE_LOG_RETAIN entries. A cursor older
+# than that gets a reset (410 / "reset" event) and must refetch the dataset.
+CHANGE_LOG_RETAIN = int(os.environ.get('CHANGE_LOG_RETAIN', '100000'))
+# Compact once this many entries beyond the retention have accumulated
+CHANGE_LOG_COMPACT_SLACK = 1000
+CHANGES_PAGE_DEFAULT = 500
+CHANGES_PAGE_MAX = 1000
+CHANGES_WAIT_MAX = 25.0  # long-poll seconds; below common proxy idle timeouts
+# Writes from this process wake waiters at once; other workers' writes are
+# seen on the next poll of the table
+CHANGES_POLL_INTERVAL = float(os.environ.get('CHANGES_POLL_INTERVAL', '0.5'))
+CHANGES_HEARTBEAT_SECONDS = 15.0
+# Streams end after this long; EventSource reconnects with Last-Event-ID
+CHANGES_STREAM_SECONDS = float(os.environ.get('CHANGES_STREAM_SECONDS', '300'))
+# A long-poll or stream occupies a worker thread for as long as it is open.
+# With sync workers (gunicorn's default) a handful of subscribers blocks the
+# whole app, so subscribe only behind threaded or async workers (e.g.
+# `gunicorn -k gthread --threads 32` or `-k gevent`). The dashboard's live
+# updates are off unless DASHBOARD_LIVE_UPDATES=1; they long-poll
+# /api/changes with DASHBOARD_LIVE_WAIT seconds per request.
+DASHBOARD_LIVE_UPDATES = os.environ.get('DASHBOARD_LIVE_UPDATES', '0') != '0'
+DASHBOARD_LIVE_WAIT = float(os.environ.get('DASHBOARD_LIVE_WAIT', '10'))
+
+
+class ChangeCursorExpired(Exception):
+    """The requested changes were compacted away (or the cursor is from another DB)."""
+
+    def __init__(self, latest: int):
+        super().__init__(latest)
+        self.latest = latest
+
+
+class ChangeFeed:
+    """Wakes long-poll/SSE waiters in this process and schedules compaction."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+
+    def notify(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+        # Checked on the background thread, off the request path
+        change_log_compactor.mark_dirty()
+
+    def wait(self, timeout: float) -> None:
+        with self._cond:
+            self._cond.wait(timeout)
+
+
+def compact_change_log_if_due() -> int:
+    """Compact when the log holds CHANGE_LOG_COMPACT_SLACK entries more than it retains.
+
+    Counts rows by seq, so one import or batch of N rows counts as N.
+    """
+    with db_pool.connection() as conn:
+        latest = _latest_change_seq(conn)
+        oldest = conn.execute('SELECT MIN(seq) FROM change_log').fetchone()[0]
+    if oldest is None or latest - oldest + 1 <= CHANGE_LOG_RETAIN + CHANGE_LOG_COMPACT_SLACK:
+        return 0
+    return compact_change_log()
+
+
+change_log_compactor = ExportWorker('change-log', compact_change_log_if_due, EXPORT_DEBOUNCE_SECONDS)
+change_feed = ChangeFeed()
+
+
+def compact_change_log(retain: int = None) -> int:
+    """Delete all but the newest `retain` change_log entries; returns rows removed."""
+    retain = CHANGE_LOG_RETAIN if retain is None else retain
+    with db_connection() as conn, _write_transaction(conn):
+        cur = conn.execute("DELETE FROM change_log WHERE seq <= "
+                           "(SELECT seq FROM sqlite_sequence WHERE name = 'change_log') - ?", (retain,))
+        return cur.rowcount
+
+
+def _latest_change_seq(conn=None) -> int:
+    if conn is None:
+        with db_pool.connection() as conn:
+            return _latest_change_seq(conn)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row['seq'] if row else 0
+
+
+def read_changes(since: int, tables, limit: int) -> dict:
+    """Changes to `tables` with seq > since, oldest first.
+
+    `next` is the cursor to resume from: past the last returned change, or
+    past every change committed before the read when none matched.
+    """
+    with db_pool.connection() as conn:
+        # latest first and the retention floor last: a compaction racing with
+        # this read can only cause a spurious reset, never a silent gap
+        latest = _latest_change_seq(conn)
+        if since > latest:
+            raise ChangeCursorExpired(latest)
+        placeholders = ','.join('?' * len(tables))
+        rows = conn.execute(
+            f'SELECT seq, table_name, op, row_id, data, changed_at FROM change_log '
+            f'WHERE seq > ? AND table_name IN ({placeholders}) ORDER BY seq LIMIT ?',
+            (since, *tables, limit)
+        ).fetchall()
+        oldest = conn.execute('SELECT MIN(seq) FROM change_log').fetchone()[0]
+    if since < latest and (oldest is None or oldest > since + 1):
+        raise ChangeCursorExpired(latest)
+    changes = [{'seq': r['seq'], 'table': r['table_name'], 'op': r['op'], 'id': r['row_id'],
+                'data': json.loads(r['data']) if r['data'] else None, 'changed_at': r['changed_at']}
+               for r in rows]
+    has_more = len(changes) == limit
+    next_seq = changes[-1]['seq'] if has_more else max(latest, changes[-1]['seq'] if changes else since)
+    return {'changes': changes, 'next': next_seq, 'has_more': has_more}
+
+
+def _change_feed_args():
+    """Parse tables/limit for the change feed; returns (tables, limit) or an error response."""
+    tables = [t for t in request.args.get('tables', 'students').split(',') if t]
+    if not tables or any(t not in CHANGE_LOG_COLUMNS for t in tables):
+        return None, (jsonify({"success": False, "message": f"tables must be from: {', '.join(CHANGE_LOG_COLUMNS)}"}), 400)
+    if 'users' in tables and current_principal()['role'] != 'admin':
+        return None, (jsonify({"success": False, "message": "Only admins can follow user changes"}), 403)
+    try:
+        limit = min(max(1, int(request.args.get('limit', CHANGES_PAGE_DEFAULT))), CHANGES_PAGE_MAX)
+    except ValueError:
+        return None, (jsonify({"success": False, "message": "limit must be an integer"}), 400)
+    return (tuple(tables), limit), None
+
+
+@app.route('/api/changes', methods=['GET'])
+@login_required
+def changes_api():
+    """Long-poll the change feed (a waiting request holds its worker thread).
+
+    Query params: since (cursor from a previous response; omit it to get the
+    current cursor without changes), tables (students,users; default
+    students), limit, wait (seconds to hold the request open when there is
+    nothing new, up to CHANGES_WAIT_MAX). 410 means the cursor has expired.
+    """
+    parsed, error = _change_feed_args()
+    if error:
+        return error
+    tables, limit = parsed
+    try:
+        since = int(request.args['since']) if 'since' in request.args else None
+        wait = min(max(0.0, float(request.args.get('wait', 0))), CHANGES_WAIT_MAX)
+    except ValueError:
+        return jsonify({"success": False, "message": "since and wait must be numbers"}), 400
+    # Don't hold a pool slot while waiting
+    release_db(None)
+
+    deadline = time.monotonic() + wait
+    try:
+        if since is None:
+            return jsonify({'success': True, 'changes': [], 'next': _latest_change_seq(), 'has_more': False}), 200
+        while True:
+            result = read_changes(since, tables, limit)
+            remaining = deadline - time.monotonic()
+            if result['changes'] or remaining <= 0:
+                break
+            change_feed.wait(min(CHANGES_POLL_INTERVAL, remaining))
+    except ChangeCursorExpired as exc:
+        return jsonify({"success": False, "message": "Cursor expired; refetch and resume from next",
+                        "reset": True, "next": exc.latest}), 410
+    return jsonify(dict(result, success=True)), 200
+
+
+def _sse_event(event: str, data, event_id=None) -> str:
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+def _change_stream(since, tables, limit):
+    started = last_sent = time.monotonic()
+    yield f'retry: {int(CHANGES_POLL_INTERVAL * 4000)}\n\n'
+    while time.monotonic() - started < CHANGES_STREAM_SECONDS:
+        try:
+            if since is None:
+                since = _latest_change_seq()
+                yield _sse_event('ready', {'next': since})
+            result = read_changes(since, tables, limit)
+        except ChangeCursorExpired as exc:
+            since = exc.latest
+            yield _sse_event('reset', {'next': since}, since)
+            continue
+        for change in result['changes']:
+            yield _sse_event('change', change, change['seq'])
+        if result['changes']:
+            last_sent = time.monotonic()
+        since = result['next']
+        if result['has_more']:
+            continue
+        if time.monotonic() - last_sent >= CHANGES_HEARTBEAT_SECONDS:
+            # Comment line: keeps proxies from timing out an idle stream
+            yield ': keep-alive\n\n'
+            last_sent = time.monotonic()
+        change_feed.wait(CHANGES_POLL_INTERVAL)
+
+
+@app.route('/api/changes/stream', methods=['GET'])
+@login_required
+def changes_stream_api():
+    """Server-Sent Events stream of the change feed (needs threaded/async workers).
+
+    Resumes from ?since= or the Last-Event-ID header an EventSource sends on
+    reconnect; otherwise starts at the current cursor (announced in a "ready"
+    event). Each change is a "change" event whose id is its seq; a "reset"
+    event means the cursor expired and the client should refetch.
+    """
+    parsed, error = _change_feed_args()
+    if error:
+        return error
+    tables, limit = parsed
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"success": False, "message": "since must be an integer"}), 400
+    response = app.response_class(_change_stream(since, tables, limit), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: don't buffer the stream
+    return response
+
+
+@app.cli.command('compact-changes')
+@click.option('--retain', type=int, default=None, help='Entries to keep (default CHANGE_LOG_RETAIN).')
+def compact_changes_command(retain):
+    """Drop old change_log entries."""
+    initialize_app()
+    click.echo(f'Removed {compact_change_log(retain)} change_log entries.')
+
 
 # Stats API (JSON)
 @app.route('/stats', methods=['GET'])
 @app.route('/stats/', methods=['GET'])
 @app.route('/api/stats', methods=['GET'])
 def stats_api():
-    conn = get_db_connection()
-    s = conn.execute('SELECT total_students, avg_marks, highest_marks, lowest_marks, updated_at FROM stats WHERE id=1').fetchone()
-    grade_rows = conn.execute('SELECT grade, count FROM grade_stats').fetchall()
-    conn.close()
+    """Aggregate stats, served from stats_cache and conditional on ETag/Last-Modified.
+
+    Between writes every call is a cache lookup; pollers that send
+    If-None-Match / If-Modified-Since get a 304 without a body.
+    """
+    entry = stats_cache.get('stats', _build_stats_response)
+    response = app.response_class(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    if entry['last_modified'] is not None:
+        response.last_modified = entry['last_modified']
+    # Clients may keep the body but must revalidate before reusing it
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _build_stats_response() -> dict:
+    with db_connection() as conn:
+        s = conn.execute('SELECT updated_at FROM stats WHERE id=1').fetchone()
+        summary = analytics_summary(conn)
 
     payload = {
-        'total_students': (s['total_students'] if s and s['total_students'] is not None else 0),
-        'avg_marks': (s['avg_marks'] if s and s['avg_marks'] is not None else 0),
-        'highest_marks': (s['highest_marks'] if s and s['highest_marks'] is not None else 0),
-        'lowest_marks': (s['lowest_marks'] if s and s['lowest_marks'] is not None else 0),
+        'total_students': (summary['total_students'] if summary['total_students'] is not None else 0),
+        'avg_marks': (summary['avg_marks'] if summary['avg_marks'] is not None else 0),
+        'highest_marks': (summary['highest_marks'] if summary['highest_marks'] is not None else 0),
+        'lowest_marks': (summary['lowest_marks'] if summary['lowest_marks'] is not None else 0),
         'updated_at': (s['updated_at'] if s else None),
-        'grade_distribution': [
-            {'grade': row['grade'], 'count': row['count']} for row in grade_rows
-        ]
+        'grade_distribution': summary['grade_distribution'],
+    }
+
+    body = app.json.dumps({'success': True, 'stats': payload}) + '\n'
+    last_modified = None
+    if payload['updated_at']:
+        # stats.updated_at is SQLite datetime('now'), i.e. UTC
+        last_modified = datetime.strptime(payload['updated_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return {
+        'body': body,
+        # updated_at has one-second resolution, so the ETag hashes the body itself
+        'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        'last_modified': last_modified,
     }
 
-    return jsonify({'success': True, 'stats': payload}), 200
+
+@app.cli.command('check-stats')
+@click.option('--repair', is_flag=True, help='Rebuild aggregates from students if they drifted.')
+def check_stats_command(repair):
+    """Verify incremental aggregates against a full recompute."""
+    initialize_app()
+    problems = check_statistics_consistency()
+    if not problems:
+        click.echo('Statistics are consistent.')
+        return
+    for problem in problems:
+        click.echo(f'MISMATCH {problem}')
+    if repair:
+        recompute_statistics()
+        click.echo('Statistics rebuilt from students table.')
+    else:
+        raise SystemExit(1)
+
+
+@app.cli.command('set-role')
+@click.argument('username')
+@click.argument('role', type=click.Choice(['admin', 'user']))
+def set_role_command(username, role):
+    """Change a user's role; running workers pick it up on their next request."""
+    initialize_app()
+    with db_connection() as conn:
+        user = conn.execute('SELECT id FROM users WHERE username=?', (username,)).fetchone()
+        if user is None:
+            raise click.ClickException(f'No user named {username}')
+        conn.execute('UPDATE users SET role=? WHERE id=?', (role, user['id']))
+        conn.commit()
+    _users_changed(user['id'])
+    click.echo(f'{username} is now {role}.')
+
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--delimiter', type=click.Choice(['tab', 'comma']), default=None, help='Defaults to sniffing the header line.')
+@click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+def import_students_command(path, delimiter, chunk_size):
+    """Bulk import students from a CSV/TSV file (e.g. exports/students_data.txt)."""
+    initialize_app()
+    with open(path, 'rb') as f:
+        report = import_students(utf8_lines(f), delimiter={'tab': '\t', 'comma': ','}.get(delimiter), chunk_size=chunk_size)
+    click.echo(f"Read {report['rows_read']} rows, inserted {report['inserted']}, rejected {report['rejected']} "
+               f"in {report['seconds']}s ({report['rows_per_second']} rows/s)")
+    for err in report['errors']:
+        click.echo(f"  line {err['line']}: {err['error']}")
+    if report['aborted']:
+        click.echo('Import stopped early; see the last error.')
+    if report['errors_truncated']:
+        click.echo(f"  ... only the first {IMPORT_MAX_REPORTED_ERRORS} errors are shown")
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
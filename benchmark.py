@@ -0,0 +1,584 @@
+"""Benchmark and load-test suite for the student marks app.
+
+Runs against a scratch database (never the repo's database.db):
+
+    python benchmark.py run --scale 100k --threads 8 --requests 500
+    python benchmark.py run --scale 1k --baseline bench-results/base.json
+    python benchmark.py compare bench-results/base.json bench-results/new.json
+    python benchmark.py multiproc --workers 4 --ops 300
+    python benchmark.py snapshot --scale 100k
+    python benchmark.py dashboard --scale 100k
+
+`run` seeds synthetic students at the requested scale, drives the scenarios
+through the Flask test client from a pool of threads and writes throughput
+and p50/p95/p99 latency as JSON. With --baseline it exits non-zero when a
+scenario regressed by more than --threshold.
+
+`multiproc` checks multi-worker mode: N separate processes (like gunicorn
+workers) start together on one scratch DB, each primes its caches, makes
+random writes and logs login events, and afterwards every worker must serve
+the same stats as the database. Aggregates, the text export and the login
+event log are verified too; it exits non-zero on any mismatch.
+
+`snapshot` compares the dashboard/stats aggregates served from the in-memory
+StudentSnapshot with the SQL path (and with a plain scan over sqlite3.Row
+objects), and reports the snapshot's memory footprint.
+
+`dashboard` measures the dashboard page: render time with the data fragments
+rebuilt on every request (the old behaviour) vs served from the fragment
+cache, a 304 revalidation, and bytes on the wire per Content-Encoding.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+SCENARIOS = ('add', 'edit', 'delete', 'dashboard', 'api_stats', 'api_login')
+SUBJECTS = ('Mathematics', 'Science', 'English', 'History', 'Physics', 'Chemistry', 'Biology', 'Geography')
+GRADES = ('A+', 'A', 'B', 'C', 'D', 'F', '')
+FIRST_NAMES = ('Rahul', 'Priya', 'Amit', 'Sneha', 'Arjun', 'Kavya', 'Rohan', 'Ananya', 'Vikram', 'Isha')
+LAST_NAMES = ('Sharma', 'Verma', 'Kumar', 'Patil', 'Reddy', 'Iyer', 'Gupta', 'Nair', 'Singh', 'Das')
+SEED_CHUNK = 10_000
+BENCH_USER = ('bench_user', 'bench_password')
+
+
+def parse_scale(value: str) -> int:
+    value = value.lower()
+    if value in SCALES:
+        return SCALES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"scale must be one of {', '.join(SCALES)} or an integer")
+
+
+def synthetic_student(rng: random.Random, i: int) -> tuple:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    marks = rng.randint(0, 100)
+    return (f'R{i:07d}', f'{first} {last}', f'{first.lower()}.{last.lower()}{i}@gmail.com',
+            rng.choice(SUBJECTS), marks, rng.choice(GRADES) or None)
+
+
+def load_app(data_dir: str):
+    """Import app.py pointed at `data_dir` (must happen before the first import)."""
+    os.environ['STUDENT_MARKS_DB'] = os.path.join(data_dir, 'bench.db')
+    os.environ['STUDENT_MARKS_EXPORT_DIR'] = os.path.join(data_dir, 'exports')
+    os.makedirs(os.environ['STUDENT_MARKS_EXPORT_DIR'], exist_ok=True)
+    # load generators replay logins from one address; don't measure the rate limiter
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    app_module.create_app()
+    return app_module
+
+
+def seed(app_module, rows: int, rng_seed: int) -> float:
+    """Top the students table up to `rows` synthetic rows. Returns seconds taken."""
+    started = time.perf_counter()
+    with app_module.db_pool.connection() as conn:
+        existing = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+        rng = random.Random(rng_seed)
+        for start in range(existing, rows, SEED_CHUNK):
+            batch = [synthetic_student(rng, i) for i in range(start, min(rows, start + SEED_CHUNK))]
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT INTO students (roll_number, name, email, subject, marks, grade) VALUES (?, ?, ?, ?, ?, ?)', batch)
+            conn.commit()
+        if not conn.execute('SELECT 1 FROM users WHERE username=?', (BENCH_USER[0],)).fetchone():
+            conn.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, 'admin')",
+                         (BENCH_USER[0], app_module.hash_password(BENCH_USER[1])))
+            conn.commit()
+    app_module.recompute_statistics()
+    return time.perf_counter() - started
+
+
+def logged_in_client(app_module):
+    client = app_module.app.test_client()
+    with app_module.db_pool.connection() as conn:
+        user = conn.execute('SELECT id, username, role FROM users WHERE username=?', (BENCH_USER[0],)).fetchone()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user['id']
+        sess['username'] = user['username']
+        sess['role'] = user['role']
+    return client
+
+
+class IdPool:
+    """Student ids shared by the edit/delete scenarios (deletes consume them)."""
+
+    def __init__(self, ids):
+        self._ids = list(ids)
+        self._lock = threading.Lock()
+
+    def pick(self):
+        with self._lock:
+            return random.choice(self._ids) if self._ids else None
+
+    def take(self):
+        with self._lock:
+            if not self._ids:
+                return None
+            i = random.randrange(len(self._ids))
+            self._ids[i], self._ids[-1] = self._ids[-1], self._ids[i]
+            return self._ids.pop()
+
+
+def scenario_request(name: str, client, rng: random.Random, ids: IdPool, counter: int):
+    """Issue one request for `name`; returns (ok, status_code)."""
+    if name == 'add':
+        row = synthetic_student(rng, 10_000_000 + counter)
+        resp = client.post('/add', data=dict(zip(('roll_number', 'name', 'email', 'subject', 'marks', 'grade'),
+                                                 ('' if v is None else str(v) for v in row))))
+        return resp.status_code == 302, resp.status_code
+    if name == 'edit':
+        student_id = ids.pick()
+        if student_id is None:
+            return False, 0
+        row = synthetic_student(rng, student_id)
+        resp = client.post(f'/edit/{student_id}', data=dict(zip(('roll_number', 'name', 'email', 'subject', 'marks', 'grade'),
+                                                                ('' if v is None else str(v) for v in row))))
+        return resp.status_code == 302, resp.status_code
+    if name == 'delete':
+        student_id = ids.take()
+        if student_id is None:
+            return False, 0
+        resp = client.post(f'/delete/{student_id}')
+        return resp.status_code == 302, resp.status_code
+    if name == 'dashboard':
+        resp = client.get('/dashboard')
+        return resp.status_code == 200, resp.status_code
+    if name == 'api_stats':
+        resp = client.get('/api/stats')
+        return resp.status_code == 200, resp.status_code
+    if name == 'api_login':
+        resp = client.post('/api/login', json={'username': BENCH_USER[0], 'password': BENCH_USER[1]})
+        return resp.status_code == 200, resp.status_code
+    raise ValueError(f'unknown scenario {name}')
+
+
+def percentile(sorted_values, p: float):
+    """Nearest-rank percentile of an ascending list (None when empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors: int, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(latencies) / seconds, 2) if seconds > 0 else 0.0,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+def run_load(app_module, name: str, threads: int, requests: int, ids: IdPool, seed_value: int,
+             request_fn=scenario_request) -> dict:
+    """Spread `requests` calls of one scenario over `threads` threads."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads + 1)
+    per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+
+    def worker(index: int, count: int):
+        nonlocal errors
+        rng = random.Random(seed_value * 1000 + index)
+        client = logged_in_client(app_module)
+        local, local_errors = [], 0
+        start_gate.wait()
+        for k in range(count):
+            started = time.perf_counter()
+            try:
+                ok, _ = request_fn(name, client, rng, ids, index * requests + k)
+            except Exception:
+                ok = False
+            local.append(time.perf_counter() - started)
+            local_errors += 0 if ok else 1
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    workers = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_thread)]
+    for w in workers:
+        w.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Scenarios whose p95 grew or throughput fell by more than `threshold` (a fraction)."""
+    regressions = []
+    for name, cur in current.get('scenarios', {}).items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        if base.get('p95_ms') and cur.get('p95_ms') is not None and cur['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {cur['p95_ms']}ms")
+        if base.get('throughput_rps') and cur['throughput_rps'] < base['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {cur['throughput_rps']} req/s")
+    return regressions
+
+
+def print_table(results: dict) -> None:
+    print(f"{'scenario':<12}{'reqs':>8}{'errs':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results['scenarios'].items():
+        print(f"{name:<12}{r['requests']:>8}{r['errors']:>6}{r['throughput_rps']:>10}"
+              f"{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}")
+
+
+def cmd_run(args) -> int:
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='student-marks-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+    app_module = load_app(data_dir)
+    print(f'Data dir: {data_dir}')
+    seed_seconds = seed(app_module, args.scale, args.seed)
+    print(f'Seeded {args.scale} students in {seed_seconds:.1f}s')
+
+    with app_module.db_pool.connection() as conn:
+        ids = IdPool(r[0] for r in conn.execute('SELECT id FROM students'))
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'scale': args.scale,
+            'threads': args.threads,
+            'requests_per_scenario': args.requests,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed_seconds': round(seed_seconds, 3),
+        },
+        'scenarios': {},
+    }
+    for name in args.scenarios:
+        results['scenarios'][name] = run_load(app_module, name, args.threads, args.requests, ids, args.seed)
+    print_table(results)
+
+    output = args.output or os.path.join('bench-results', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.scale}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {output}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            return 1
+    return 0
+
+
+def multiproc_worker(data_dir: str, index: int, workers: int, ops: int, events: int, seed_value: int,
+                     start_gate, done_gate, results) -> None:
+    """One simulated server process for `multiproc` (runs in a spawned interpreter)."""
+    app_module = load_app(data_dir)
+    client = logged_in_client(app_module)
+    rng = random.Random(seed_value * 1000 + index)
+    with app_module.db_pool.connection() as conn:
+        ids = IdPool(r[0] for r in conn.execute('SELECT id FROM students WHERE id % ? = ?', (workers, index)))
+    client.get('/api/stats')
+    client.get('/api/stats/subjects')
+
+    start_gate.wait()
+    started = time.perf_counter()
+    errors = 0
+    for k in range(ops):
+        counter = index * ops + k
+        kind = rng.choice(('add', 'edit', 'delete', 'batch'))
+        if kind == 'batch':
+            batch = [synthetic_student(rng, rng.randrange(1_000_000)) for _ in range(5)]
+            resp = client.post('/api/students/batch', json={'ops': [
+                {'op': 'upsert', 'student': dict(zip(('roll_number', 'name', 'email', 'subject', 'marks', 'grade'), row))}
+                for row in batch]})
+            ok = resp.status_code == 200
+        else:
+            ok, _ = scenario_request(kind, client, rng, ids, counter)
+        errors += 0 if ok else 1
+        if k < events:
+            app_module.append_login_event(index, f'worker{index}', 'user')
+        if k % 5 == 4:
+            # Reads interleaved with writes keep a cached payload around to go stale
+            client.get('/api/stats')
+    seconds = time.perf_counter() - started
+    client.get('/api/stats')
+    app_module.login_event_writer.close()
+    done_gate.wait()
+
+    stats = client.get('/api/stats')
+    subjects = client.get('/api/stats/subjects').get_data()
+    app_module.students_exporter.flush()
+    results.put({
+        'worker': index,
+        'pid': os.getpid(),
+        'errors': errors,
+        'seconds': seconds,
+        'total_students': stats.get_json()['stats']['total_students'],
+        'etag': stats.headers.get('ETag'),
+        'subjects_sha1': hashlib.sha1(subjects).hexdigest(),
+    })
+
+
+def cmd_multiproc(args) -> int:
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='student-marks-multiproc-')
+    os.makedirs(data_dir, exist_ok=True)
+    # Inherited by the workers: rotate the login log often and export eagerly
+    os.environ['LOGIN_EVENTS_MAX_BYTES'] = '4096'
+    os.environ['LOGIN_EVENTS_BACKUPS'] = '10000'
+    os.environ['EXPORT_DEBOUNCE_SECONDS'] = '0.05'
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    app_module = load_app(data_dir)
+    print(f'Data dir: {data_dir}')
+    seed(app_module, args.scale, args.seed)
+    app_module.db_pool.close_idle()
+
+    # spawn, not fork: every worker imports and initializes the app on its own
+    ctx = multiprocessing.get_context('spawn')
+    start_gate = ctx.Barrier(args.workers)
+    done_gate = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=multiproc_worker,
+                         args=(data_dir, i, args.workers, args.ops, args.events, args.seed, start_gate, done_gate, results))
+             for i in range(args.workers)]
+    for proc in procs:
+        proc.start()
+    reports = [results.get(timeout=600) for _ in procs]
+    for proc in procs:
+        proc.join()
+    reports.sort(key=lambda r: r['worker'])
+
+    with app_module.db_pool.connection() as conn:
+        total = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+        meta = {r['key']: r['value'] for r in conn.execute('SELECT key, value FROM app_meta')}
+    with open(app_module.STUDENTS_EXPORT, encoding='utf-8') as f:
+        exported = sum(1 for _ in f) - 1
+    log_dir = os.path.dirname(app_module.LOGIN_EVENTS)
+    logged = 0
+    for name in os.listdir(log_dir):
+        if name == 'login_events.txt' or name.startswith('login_events.txt.') and name[len('login_events.txt.'):].isdigit():
+            with open(os.path.join(log_dir, name), encoding='utf-8') as f:
+                logged += sum(1 for _ in f)
+
+    write_ops = args.workers * args.ops
+    wall = max(r['seconds'] for r in reports)
+    print(f"{'worker':<8}{'pid':>8}{'errors':>8}{'seconds':>10}{'total':>10}  etag")
+    for r in reports:
+        print(f"{r['worker']:<8}{r['pid']:>8}{r['errors']:>8}{r['seconds']:>10.2f}{r['total_students']:>10}  {r['etag']}")
+    print(f'{write_ops} write ops from {args.workers} processes in {wall:.2f}s ({write_ops / wall:.0f} ops/s)')
+
+    checks = {
+        'no request errors': all(r['errors'] == 0 for r in reports),
+        'every worker serves the current total': all(r['total_students'] == total for r in reports),
+        'every worker serves the same stats (ETag)': len({r['etag'] for r in reports}) == 1,
+        'every worker serves the same subject rollups': len({r['subjects_sha1'] for r in reports}) == 1,
+        'aggregates match a full recompute': not app_module.check_statistics_consistency(),
+        'stats version is current': meta['stats_version'] == meta['students_version'],
+        'students export is the newest': meta['students_export_version'] == meta['students_version'] and exported == total,
+        'no login events lost': logged == args.workers * min(args.events, args.ops),
+    }
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return 0 if all(checks.values()) else 1
+
+
+def _time_calls(fn, repeat: int) -> float:
+    """Median seconds per call over `repeat` calls."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def cmd_snapshot(args) -> int:
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='student-marks-snapshot-')
+    os.makedirs(data_dir, exist_ok=True)
+    app_module = load_app(data_dir)
+    print(f'Data dir: {data_dir}')
+    seed(app_module, args.scale, args.seed)
+    snapshot = app_module.student_snapshot
+    snapshot.enabled = True
+
+    def row_scan(conn):
+        # What the analytics cost without aggregate tables or a snapshot
+        rows = conn.execute('SELECT subject, marks, grade FROM students').fetchall()
+        marks = [row['marks'] for row in rows]
+        grades = Counter(app_module._grade_key(row['grade']) for row in rows)
+        return len(marks), sum(marks), max(marks, default=None), min(marks, default=None), grades, sorted({row['subject'] for row in rows})
+
+    with app_module.db_pool.connection() as conn:
+        snapshot.aggregates()
+        reload_seconds = snapshot.stats()['last_reload_seconds']
+        same = app_module._analytics_from_sql(conn) == snapshot.aggregates()
+        tracemalloc.start()
+        rows = conn.execute('SELECT id, subject, marks, grade FROM students').fetchall()
+        row_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del rows
+        timings = {
+            'sql (aggregate tables + DISTINCT subject)': _time_calls(lambda: app_module._analytics_from_sql(conn), args.repeat),
+            'sqlite3.Row scan': _time_calls(lambda: row_scan(conn), max(3, args.repeat // 10)),
+            'snapshot': _time_calls(snapshot.aggregates, args.repeat),
+        }
+
+    # A write followed by a read: incremental apply vs the SQL path
+    client = logged_in_client(app_module)
+    rng = random.Random(args.seed)
+
+    def write_then(read):
+        row = synthetic_student(rng, rng.randrange(1_000_000))
+        client.post('/add', data=dict(zip(('roll_number', 'name', 'email', 'subject', 'marks', 'grade'),
+                                          ('' if v is None else str(v) for v in row))))
+        read()
+
+    with app_module.db_pool.connection() as conn:
+        write_sql = _time_calls(lambda: write_then(lambda: app_module._analytics_from_sql(conn)), args.repeat)
+        write_snapshot = _time_calls(lambda: write_then(snapshot.aggregates), args.repeat)
+        same_after_writes = app_module._analytics_from_sql(conn) == snapshot.aggregates()
+
+    memory = snapshot.memory_footprint()
+    print(f"rows: {memory['rows']}  snapshot: {memory['total_bytes'] / 1024:.0f} KiB ({memory['bytes_per_row']} B/row)  "
+          f"sqlite3.Row list: {row_bytes / 1024:.0f} KiB ({row_bytes / max(1, memory['rows']):.0f} B/row)  "
+          f"reload: {reload_seconds:.3f}s")
+    base = timings['sql (aggregate tables + DISTINCT subject)']
+    for name, seconds in timings.items():
+        print(f'{name:<44}{seconds * 1e6:>12.1f} us{base / seconds:>10.2f}x')
+    print(f"{'add + read, sql':<44}{write_sql * 1e6:>12.1f} us")
+    print(f"{'add + read, snapshot (incremental apply)':<44}{write_snapshot * 1e6:>12.1f} us")
+    print(f"snapshot matches SQL: {same and same_after_writes}  (reloads={snapshot.stats()['reloads']}, "
+          f"applied={snapshot.stats()['applied_changes']})")
+    return 0 if same and same_after_writes else 1
+
+
+def cmd_dashboard(args) -> int:
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='student-marks-dashboard-')
+    os.makedirs(data_dir, exist_ok=True)
+    app_module = load_app(data_dir)
+    print(f'Data dir: {data_dir}')
+    seed(app_module, args.scale, args.seed)
+    client = logged_in_client(app_module)
+
+    def cold():
+        app_module.dashboard_cache.bump()
+        return client.get('/dashboard')
+
+    first = client.get('/dashboard')
+    etag = first.headers['ETag']
+    timings = {
+        'fragments rebuilt per request': _time_calls(cold, args.repeat),
+        'fragments cached': _time_calls(lambda: client.get('/dashboard'), args.repeat),
+        'If-None-Match -> 304': _time_calls(lambda: client.get('/dashboard', headers={'If-None-Match': etag}), args.repeat),
+    }
+    base = timings['fragments rebuilt per request']
+    for name, seconds in timings.items():
+        print(f'{name:<36}{seconds * 1e3:>10.2f} ms{base / seconds:>10.2f}x')
+
+    ok = client.get('/dashboard', headers={'If-None-Match': etag}).status_code == 304
+    print(f"{'encoding':<36}{'bytes':>10}")
+    for encoding in ('identity',) + app_module.COMPRESS_ENCODINGS:
+        resp = client.get('/dashboard', headers={'Accept-Encoding': encoding})
+        ok = ok and resp.headers.get('Content-Encoding', 'identity') == encoding
+        print(f'{encoding:<36}{len(resp.get_data()):>10}')
+    print(f"{'304':<36}{len(client.get('/dashboard', headers={'If-None-Match': etag}).get_data()):>10}")
+    return 0 if ok else 1
+
+
+def cmd_compare(args) -> int:
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if not regressions:
+        print('No regressions beyond threshold.')
+    return 1 if regressions else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='seed a scratch DB and run the load scenarios')
+    run.add_argument('--scale', type=parse_scale, default=SCALES['1k'], help='1k, 10k, 100k, 1m or a row count')
+    run.add_argument('--threads', type=int, default=4)
+    run.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    run.add_argument('--scenarios', type=lambda v: [s for s in v.split(',') if s], default=list(SCENARIOS),
+                     help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--data-dir', help='reuse/keep the scratch DB here instead of a temp dir')
+    run.add_argument('--output', help='results JSON path (default bench-results/<time>-<scale>.json)')
+    run.add_argument('--baseline', help='results JSON to compare against')
+    run.add_argument('--threshold', type=float, default=0.10, help='allowed regression as a fraction (default 0.10)')
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser('compare', help='compare two results files')
+    cmp_.add_argument('baseline')
+    cmp_.add_argument('current')
+    cmp_.add_argument('--threshold', type=float, default=0.10)
+    cmp_.set_defaults(func=cmd_compare)
+
+    mp = sub.add_parser('multiproc', help='check cache/aggregate/export coherence across N worker processes')
+    mp.add_argument('--workers', type=int, default=4)
+    mp.add_argument('--ops', type=int, default=200, help='write operations per worker')
+    mp.add_argument('--events', type=int, default=200, help='login events logged per worker')
+    mp.add_argument('--scale', type=parse_scale, default=SCALES['1k'], help='rows seeded before the workers start')
+    mp.add_argument('--seed', type=int, default=42)
+    mp.add_argument('--data-dir', help='keep the scratch DB here instead of a temp dir')
+    mp.set_defaults(func=cmd_multiproc)
+
+    snap = sub.add_parser('snapshot', help='measure the in-memory analytics snapshot against the SQL path')
+    snap.add_argument('--scale', type=parse_scale, default=SCALES['100k'], help='rows to seed')
+    snap.add_argument('--repeat', type=int, default=200, help='timed calls per path')
+    snap.add_argument('--seed', type=int, default=42)
+    snap.add_argument('--data-dir', help='keep the scratch DB here instead of a temp dir')
+    snap.set_defaults(func=cmd_snapshot)
+
+    dash = sub.add_parser('dashboard', help='measure dashboard render time, 304s and compressed size')
+    dash.add_argument('--scale', type=parse_scale, default=SCALES['100k'], help='rows to seed')
+    dash.add_argument('--repeat', type=int, default=100, help='timed requests per case')
+    dash.add_argument('--seed', type=int, default=42)
+    dash.add_argument('--data-dir', help='keep the scratch DB here instead of a temp dir')
+    dash.set_defaults(func=cmd_dashboard)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'scenarios', None):
+        unknown = set(args.scenarios) - set(SCENARIOS)
+        if unknown:
+            print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+            return 2
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,45 +1,184 @@
+// Server-side search via /api/search (FTS index), debounced per keystroke
+const searchState = { timer: null, seq: 0 };
+
 function searchTable() {
-    const input = (document.getElementById('search')?.value || '').toLowerCase();
-    const selectedBranch = (document.getElementById('branchFilter')?.value || '').toLowerCase();
-    // Support both old id #marksTable and new #studentsTable
-    const table = document.getElementById('studentsTable') || document.getElementById('marksTable');
-    if (!table) return;
-    const rows = table.querySelectorAll('tbody tr');
-    const matches = [];
-    rows.forEach((row) => {
-        const cellsLower = Array.from(row.getElementsByTagName('td')).map(td => (td.textContent || '').toLowerCase());
-        const cellsDisplay = Array.from(row.getElementsByTagName('td')).map(td => (td.textContent || '').trim());
-        const rowText = cellsLower.join(' ');
-        const subjectLower = (cellsLower[3] || '');
-        const branchOk = selectedBranch.length === 0 || subjectLower === selectedBranch;
-        const searchOk = input.length === 0 || rowText.includes(input);
-        const show = branchOk && searchOk;
-        row.style.display = show ? '' : 'none';
-        if (show && input.length > 0) {
-            matches.push({
-                row: row,
-                roll: cellsDisplay[0] || '',
-                name: cellsDisplay[1] || '',
-                email: cellsDisplay[2] || '',
-                subject: cellsDisplay[3] || '',
-                marks: cellsDisplay[4] || '',
-                grade: cellsDisplay[5] || ''
-            });
-        }
-    });
+    const field = document.getElementById('search');
+    if (!field) return;
+    clearTimeout(searchState.timer);
+    searchState.timer = setTimeout(runSearch, 150);
+}
+
+function runSearch() {
+    const field = document.getElementById('search');
+    const query = (field?.value || '').trim();
+    if (!query) {
+        renderSearchResults([], '');
+        return;
+    }
+    const params = new URLSearchParams({ q: query, limit: '10' });
+    const branch = document.getElementById('branchFilter')?.value || '';
+    if (branch) params.set('subject', branch);
 
-    renderSearchResults(matches, input);
+    // Ignore responses that arrive after a newer keystroke
+    const seq = ++searchState.seq;
+    fetch(`${field.dataset.searchUrl}?${params.toString()}`, { headers: { 'Accept': 'application/json' } })
+        .then(resp => resp.json())
+        .then(data => {
+            if (seq !== searchState.seq) return;
+            renderSearchResults(data.success ? data.results : [], query);
+        })
+        .catch(() => {
+            if (seq === searchState.seq) renderSearchResults([], query);
+        });
 }
 
 function applyBranchFilter() {
-    // Re-run the combined filter when branch changes
-    searchTable();
+    // Branch filtering happens server-side; reload the first page
+    loadStudents(true);
 }
 
+// Lazy, cursor-paginated loading of the students table from /api/students
+const studentsPager = { cursor: null, hasMore: true, loading: false };
+
+function loadStudents(reset) {
+    const body = document.getElementById('studentsBody');
+    if (!body || studentsPager.loading) return;
+    if (reset) {
+        body.innerHTML = '';
+        studentsPager.cursor = null;
+        studentsPager.hasMore = true;
+    }
+    if (!studentsPager.hasMore) return;
+
+    const params = new URLSearchParams({ limit: '100' });
+    const branch = document.getElementById('branchFilter')?.value || '';
+    if (branch) params.set('subject', branch);
+    if (studentsPager.cursor) params.set('cursor', studentsPager.cursor);
+
+    studentsPager.loading = true;
+    setPagerStatus('Loading...');
+    fetch(`${body.dataset.apiUrl}?${params.toString()}`, { headers: { 'Accept': 'application/json' } })
+        .then(resp => resp.json())
+        .then(data => {
+            if (!data.success) throw new Error(data.message || 'Failed to load students');
+            const isAdmin = body.dataset.isAdmin === 'true';
+            const frag = document.createDocumentFragment();
+            data.students.forEach(s => frag.appendChild(buildStudentRow(s, isAdmin)));
+            body.appendChild(frag);
+            studentsPager.cursor = data.next_cursor;
+            studentsPager.hasMore = data.has_more;
+            setPagerStatus(body.children.length === 0 ? 'No students found' : '');
+        })
+        .catch(err => setPagerStatus(err.message))
+        .finally(() => {
+            studentsPager.loading = false;
+            const btn = document.getElementById('loadMoreBtn');
+            if (btn) btn.style.display = studentsPager.hasMore ? '' : 'none';
+        });
+}
+
+function buildStudentRow(s, isAdmin) {
+    const row = document.createElement('tr');
+    row.dataset.id = s.id;
+    row.innerHTML = `
+        <td>${escapeHtml(s.roll_number)}</td>
+        <td><a href="/student/${s.id}" class="student-link">${escapeHtml(s.name)}</a></td>
+        <td>${escapeHtml(s.email || '')}</td>
+        <td>${escapeHtml(s.subject)}</td>
+        <td>${escapeHtml(s.marks)}</td>
+        <td>${escapeHtml(s.grade || '')}</td>`;
+    if (isAdmin) {
+        const actions = document.createElement('td');
+        actions.innerHTML = `
+            <div class="btn-group" role="group">
+                <a href="/edit/${s.id}" class="btn btn-sm btn-primary"><i class="bi bi-pencil"></i> Edit</a>
+                <form method="POST" action="/delete/${s.id}" class="d-inline" onsubmit="return confirm('Are you sure you want to delete this record?');">
+                    <button type="submit" class="btn btn-sm btn-danger"><i class="bi bi-trash"></i> Delete</button>
+                </form>
+            </div>`;
+        row.appendChild(actions);
+    }
+    return row;
+}
+
+// Apply student changes from the change feed (long-polling /api/changes) to
+// the loaded rows and the branch list; onChange runs after each batch.
+// Only enabled when the server sets data-changes-url (DASHBOARD_LIVE_UPDATES).
+function subscribeStudentChanges(onChange) {
+    const body = document.getElementById('studentsBody');
+    if (!body || !body.dataset.changesUrl) return;
+    const url = body.dataset.changesUrl;
+    const wait = body.dataset.changesWait || '10';
+    const getJson = query => fetch(`${url}?${query}`, { headers: { 'Accept': 'application/json' } })
+        .then(resp => resp.json().then(data => ({ status: resp.status, data })));
+    const pause = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+    const poll = since => {
+        // Don't hold a server request open for a tab nobody is looking at
+        if (document.hidden) {
+            document.addEventListener('visibilitychange', () => poll(since), { once: true });
+            return;
+        }
+        getJson(new URLSearchParams({ since, wait, tables: 'students' }).toString())
+            .then(({ status, data }) => {
+                if (status === 410) {
+                    // Changes were compacted away while we were not looking: start over
+                    loadStudents(true);
+                    onChange();
+                    return data.next;
+                }
+                if (!data.success) throw new Error(data.message);
+                data.changes.forEach(change => applyStudentChange(body, change));
+                if (data.changes.length) onChange();
+                return data.next;
+            })
+            .then(next => poll(next), () => pause(5000).then(() => poll(since)));
+    };
+
+    getJson('')
+        .then(({ data }) => poll(data.next))
+        .catch(() => {});
+}
+
+function applyStudentChange(body, change) {
+    const student = change.data;
+    const row = body.querySelector(`tr[data-id="${change.id}"]`);
+    const branch = document.getElementById('branchFilter');
+    if (change.op !== 'delete' && branch && student.subject &&
+        !Array.from(branch.options).some(o => o.value === student.subject)) {
+        branch.add(new Option(student.subject, student.subject));
+    }
+    if (!row) return;  // New rows show up when their page is loaded
+    if (change.op === 'delete' || (branch && branch.value && branch.value !== student.subject)) {
+        row.remove();
+    } else {
+        row.replaceWith(buildStudentRow(student, body.dataset.isAdmin === 'true'));
+    }
+}
+
+function setPagerStatus(text) {
+    const status = document.getElementById('studentsStatus');
+    if (status) status.textContent = text;
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const body = document.getElementById('studentsBody');
+    if (!body) return;
+    loadStudents(true);
+    // Fetch the next page as the pager scrolls into view
+    const pager = document.getElementById('studentsPager');
+    if (pager && 'IntersectionObserver' in window) {
+        new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) loadStudents(false);
+        }, { rootMargin: '200px' }).observe(pager);
+    }
+});
+
 function clearSearch() {
     const input = document.getElementById('search');
     if (input) input.value = '';
-    searchTable();
+    clearTimeout(searchState.timer);
+    searchState.seq++;
     const results = document.getElementById('searchResults');
     if (results) {
         results.style.display = 'none';
@@ -69,36 +208,15 @@ function renderSearchResults(matches, query) {
 
     matches.slice(0, maxItems).forEach((m, i) => {
         const item = document.createElement('a');
-        item.href = 'javascript:void(0)';
+        item.href = `/student/${m.id}`;
         item.className = 'list-group-item list-group-item-action small opacity-75';
-        item.innerHTML = `${highlightText(m.roll, query)} — <strong>${highlightText(m.name, query)}</strong> | ${highlightText(m.email, query)} | ${highlightText(m.subject, query)} | Marks: ${highlightText(m.marks, query)} | Grade: ${highlightText(m.grade, query)}`;
-        item.onclick = () => {
-            highlightRow(m.row);
-        };
+        item.innerHTML = `${highlightText(m.roll_number, query)} — <strong>${highlightText(m.name, query)}</strong> | ${highlightText(m.email, query)} | ${highlightText(m.subject, query)} | Marks: ${highlightText(m.marks, query)} | Grade: ${highlightText(m.grade, query)}`;
         container.appendChild(item);
     });
 
-    if (matches.length > maxItems) {
-        const more = document.createElement('div');
-        more.className = 'list-group-item text-muted';
-        more.textContent = `+ ${matches.length - maxItems} more`;
-        container.appendChild(more);
-    }
-
     container.style.display = '';
 }
 
-function highlightRow(row) {
-    if (!row) return;
-    row.scrollIntoView({ behavior: 'smooth', block: 'center' });
-    const original = row.style.backgroundColor;
-    row.style.transition = 'background-color 0.3s ease';
-    row.style.backgroundColor = 'rgba(13, 110, 253, 0.12)';
-    setTimeout(() => {
-        row.style.backgroundColor = original || '';
-    }, 1200);
-}
-
 function highlightText(text, query) {
     const safe = escapeHtml(String(text || ''));
     if (!query) return safe;